@@ -0,0 +1,87 @@
+"""Startup budget check for the studio CLI
+
+Runs `studio --help` and `studio get-conf` in fresh interpreters, reports the
+median wall-clock time and fails if it exceeds the budget, or if boto3 got
+imported by a command that doesn't talk to AWS.
+
+Usage:
+    python benchmarks/startup.py [--budget-ms 150] [--runs 10]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+# Runs a command in-process and reports whether boto3 was imported along the way
+PROBE = """
+import sys
+from studio.studio import cli
+try:
+    cli({args!r}, prog_name="studio")
+except SystemExit:
+    pass
+print("boto3" in sys.modules, file=sys.stderr)
+"""
+
+COMMANDS = [["--help"], ["get-conf"]]
+
+
+def run_once(args: list) -> tuple:
+    """Runs one command in a fresh interpreter
+
+    Parameters:
+        args (list): CLI arguments
+
+    Returns:
+        tuple: (seconds elapsed, whether boto3 was imported)
+    """
+
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(args=args)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    elapsed = time.perf_counter() - start
+
+    imported_boto3 = result.stderr.strip().splitlines()[-1] == "True"
+
+    return elapsed, imported_boto3
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=150)
+    parser.add_argument("--runs", type=int, default=10)
+    options = parser.parse_args()
+
+    failed = False
+
+    for args in COMMANDS:
+        timings = []
+        for _ in range(options.runs):
+            elapsed, imported_boto3 = run_once(args)
+            timings.append(elapsed * 1000)
+
+            if imported_boto3:
+                print(f"studio {' '.join(args)}: imported boto3")
+                failed = True
+                break
+
+        median = statistics.median(timings)
+        verdict = "ok" if median <= options.budget_ms else "OVER BUDGET"
+        print(
+            f"studio {' '.join(args):<10} median {median:6.1f} ms "
+            f"(budget {options.budget_ms:.0f} ms) {verdict}"
+        )
+
+        failed = failed or median > options.budget_ms
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
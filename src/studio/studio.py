@@ -1,38 +1,204 @@
 import click
 from studio.utils.cli import *
-from studio.utils.aws import *
+from studio.utils.progress import Progress
+from concurrent.futures import ThreadPoolExecutor
+import copy
 import json
+import time
+from datetime import datetime
+
+# studio.utils.aws pulls in boto3, which is slow to import. Commands import it
+# when they run, so --help, configure prompts and get-conf stay fast.
 
 
 class Config(object):
     def __init__(self) -> None:
         self.verbose = False
+        self.use_daemon = True
+        self.tracing = False
+        self.event_id = None
+        self.profile = DEFAULT_PROFILE
+        self.selected_profiles = [DEFAULT_PROFILE]
+        # Whether profiles were picked with --profile or --all-profiles
+        self.profiles_given = False
         self.update_from_conf_file()
 
-    ALLOWED_KEYS = ["verbose", "region", "domain_id", "table_name"]
+    ALLOWED_KEYS = ["verbose", "region", "domain_id", "table_name", "event_id"]
 
     # Merge existing conf with Config object
     def update_from_conf_file(self):
-        conf = get_configuration()
-        if conf:
-            for key, value in conf.items():
-                if key in self.ALLOWED_KEYS:
-                    setattr(self, key, value)
+        # Read once and reused by require_cli_config and get-conf
+        self.conf = get_configuration()
+        self.profiles = get_profiles(self.conf)
+
+        if self.profiles and DEFAULT_PROFILE not in self.profiles:
+            # Only named profiles are configured. Use the first one.
+            self.selected_profiles = [next(iter(self.profiles))]
+
+        self.use_profile(self.selected_profiles[0])
+
+    def use_profile(self, name: str) -> None:
+        """Points the Config object at one of the configured profiles"""
+        self.profile = name
+        # Not every profile has an event ID. Don't keep the one of another profile
+        self.event_id = None
+        for key, value in self.profiles.get(name, {}).items():
+            if key in self.ALLOWED_KEYS:
+                setattr(self, key, value)
+
+    def for_profile(self, name: str) -> "Config":
+        """Gets a copy of the Config object pointing at another profile"""
+        profile_config = copy.copy(self)
+        profile_config.use_profile(name)
+        return profile_config
+
+    @property
+    def fan_out(self) -> bool:
+        """Whether commands run against several domains"""
+        return len(self.selected_profiles) > 1
 
 
 pass_config = click.make_pass_decorator(Config, ensure=True)
 
 
+def request_daemon(config: Config, command: str, args: dict = None) -> dict:
+    """Sends a command to the daemon of the selected profile, if one is running
+
+    Returns:
+        dict: Result of the command, or None to run the command directly
+    """
+    if config.fan_out or not config.use_daemon:
+        return None
+
+    from studio.utils.daemon import request_daemon
+
+    return request_daemon(config.profile, command, args)
+
+
+def run_for_profiles(config: Config, func) -> dict:
+    """Runs func(profile_config) for every selected profile concurrently
+
+    Returns:
+        dict: {'profile name': result}
+    """
+
+    if not config.fan_out:
+        return {config.profile: func(config)}
+
+    with ThreadPoolExecutor(max_workers=len(config.selected_profiles)) as executor:
+        futures = {
+            name: executor.submit(func, config.for_profile(name))
+            for name in config.selected_profiles
+        }
+
+    return {name: future.result() for name, future in futures.items()}
+
+
 @click.group()
 @click.option("-v", "--verbose", is_flag=True)
+@click.option(
+    "-p",
+    "--profile",
+    "profiles",
+    multiple=True,
+    help="Profile (domain) to use. Repeat to run against several domains at once",
+)
+@click.option(
+    "--all-profiles", is_flag=True, help="Run against all configured domains at once"
+)
+@click.option(
+    "--no-daemon", is_flag=True, help="Don't use the daemon, even if it's running"
+)
+@click.option(
+    "--record",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Record every AWS call to this trace file (gzipped if it ends with .gz)",
+)
+@click.option(
+    "--replay",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Answer AWS calls from a trace file made with --record instead of AWS",
+)
+@click.option(
+    "--replay-speed",
+    type=click.FloatRange(min=0),
+    default=1,
+    show_default=True,
+    help="How much faster than recorded to answer calls when replaying. 0 answers immediately",
+)
 @pass_config
-def cli(config, verbose):
+@click.pass_context
+def cli(
+    ctx,
+    config,
+    verbose,
+    profiles,
+    all_profiles,
+    no_daemon,
+    record,
+    replay,
+    replay_speed,
+):
     config.verbose = verbose
+    config.use_daemon = not no_daemon
+
+    if record and replay:
+        raise click.UsageError("--record and --replay can't be used together")
+
+    if record or replay:
+        from studio.utils.trace import Recorder, Replayer
+
+        tracer = Recorder(record) if record else Replayer(replay, replay_speed)
+        tracer.start()
+        ctx.call_on_close(tracer.close)
+
+        # Calls made by the daemon or by worker processes would be missed
+        config.tracing = True
+        config.use_daemon = False
+
+    if all_profiles:
+        profiles = list(config.profiles)
+
+    if not profiles:
+        return
+
+    if ctx.invoked_subcommand != "configure":
+        unknown = [name for name in profiles if name not in config.profiles]
+        if unknown:
+            raise click.BadParameter(
+                f"Unknown profile(s): {', '.join(unknown)}. Configure them with 'studio --profile <name> configure'",
+                param_hint="--profile",
+            )
+
+    config.profiles_given = True
+    config.selected_profiles = list(dict.fromkeys(profiles))
+    config.use_profile(config.selected_profiles[0])
 
 
 @cli.command()
-def configure():
+@pass_config
+@click.option(
+    "--capacity",
+    type=click.IntRange(min=1),
+    help="Maximum number of users in this domain, used by 'setup-users --assign capacity'",
+)
+@click.option(
+    "--event-id",
+    help="Tag resources with this event ID, so status and purge only touch this event's resources. Defaults to the current one",
+)
+def configure(config, capacity, event_id):
     """Configures the hackathon CLI with relevant information"""
+    if config.fan_out:
+        raise click.UsageError("Configure one profile at a time")
+
+    if not config.profiles_given and config.profiles and DEFAULT_PROFILE not in config.profiles:
+        raise click.UsageError(
+            f"Only named profiles are configured. Pick the one to configure with --profile, or '--profile {DEFAULT_PROFILE}' to add a default profile"
+        )
+
+    if config.profile != DEFAULT_PROFILE:
+        click.secho(f"Configuring profile '{config.profile}'", fg="cyan")
+
     region = click.prompt(
         "What AWS region do you want to use?", type=str, default="eu-west-1"
     )
@@ -44,11 +210,28 @@ def configure():
             click.secho("That's not the Domain ID, and you know it", fg="red")
         domain_id = click.prompt("Enter the SageMaker Studio Domain ID", type=str)
 
+    from studio.utils.aws import get_or_create_table
+
     table_name = get_or_create_table(region)
 
-    store_configuration(
-        {"region": region, "domain_id": domain_id.strip(), "table_name": table_name}
-    )
+    profile = {"region": region, "domain_id": domain_id.strip(), "table_name": table_name}
+    if capacity:
+        profile["capacity"] = capacity
+
+    event_id = event_id or config.profiles.get(config.profile, {}).get("event_id")
+    if event_id:
+        profile["event_id"] = event_id
+
+    store_profile(config.profile, profile)
+
+    # The web app only looks in the table of its own region, unless told otherwise
+    state_tables = get_state_tables(get_profiles(get_configuration()))
+    if len(state_tables) > 1:
+        click.secho(
+            "\nParticipants are spread over several tables. Deploy the web app with "
+            f"--parameter-overrides StateTables={','.join(state_tables)}",
+            fg="yellow",
+        )
 
     click.secho("\n\U0001F973 studio cli is now ready to be used", fg="cyan")
     click.secho(
@@ -62,45 +245,283 @@ def configure():
 @require_cli_config
 def get_conf(config):
     """Prints current configuration"""
-    click.secho(json.dumps(get_configuration(), indent=3), fg="cyan")
+    click.secho(json.dumps(config.conf, indent=3), fg="cyan")
+
+
+def sharding_options(func):
+    """Adds the options for running a command as a sharded run"""
+
+    func = click.option(
+        "--run-id",
+        help="Join the sharded run with this ID. Use the same ID on every host taking part",
+    )(func)
+    func = click.option(
+        "--shards",
+        type=click.IntRange(min=1),
+        default=32,
+        show_default=True,
+        help="Number of shards the work is split into in a sharded run",
+    )(func)
+    func = click.option(
+        "--workers",
+        type=click.IntRange(min=1),
+        default=1,
+        show_default=True,
+        help="Number of worker processes. More than 1 starts a sharded run",
+    )(func)
+
+    return func
+
+
+def run_sharded_command(config, task_name, payload, run_id, shards, workers):
+    """Runs a command as a sharded run and reports how far it got"""
+    from studio.utils.shards import format_run_progress, run_sharded
+
+    if config.tracing and workers > 1:
+        raise click.UsageError("--record and --replay only work with --workers 1")
+
+    run_id = run_id or f"{task_name}-{round(time.time())}"
+    click.secho(
+        f"Starting sharded run {run_id} with {workers} worker(s). "
+        f"Other hosts can join with --run-id {run_id} --shards {shards}",
+        fg="cyan",
+    )
+
+    progress = run_sharded(config, task_name, payload, run_id, shards, workers)
+    progress["run_id"] = run_id
+    click.secho(format_run_progress(run_id, progress), fg="cyan")
+
+    if progress["running"]:
+        click.secho(
+            f"Other hosts are still working on {progress['running']} shard(s). "
+            f"Follow them with 'studio run-status {run_id}'",
+            fg="cyan",
+        )
+
+    return progress
 
 
 @cli.command()
 @pass_config
 @require_cli_config
 @click.argument("path", type=click.Path(exists=True))
-def setup_users(config, path):
+@click.option(
+    "--space-mode",
+    type=click.Choice(SPACE_MODES),
+    default="user",
+    show_default=True,
+    help="Create private Jupyter and Code Editor spaces per user, or one shared space per team",
+)
+@click.option(
+    "--assign",
+    type=click.Choice(ASSIGNMENT_STRATEGIES),
+    default="team",
+    show_default=True,
+    help="With several profiles: spread teams evenly over the domains, or fill each domain up to its configured capacity",
+)
+@click.option(
+    "--access-start",
+    type=click.DateTime(DATETIME_FORMATS),
+    help="Local time from which participants can log in through the web app. Defaults to now",
+)
+@click.option(
+    "--access-end",
+    type=click.DateTime(DATETIME_FORMATS),
+    help="Local time after which the web app stops issuing login URLs",
+)
+@click.option(
+    "--retention-days",
+    type=click.IntRange(min=0),
+    default=7,
+    show_default=True,
+    help="Days after --access-end until DynamoDB deletes the users through TTL",
+)
+@click.option(
+    "--jit",
+    is_flag=True,
+    help="Only store the users. The web app creates each user's profile and spaces on their first login",
+)
+@sharding_options
+def setup_users(
+    config,
+    path,
+    space_mode,
+    assign,
+    access_start,
+    access_end,
+    retention_days,
+    jit,
+    workers,
+    shards,
+    run_id,
+):
     """Creates users and teams"""
-    # Reset DynamoDB
-    clear_ddb(config)
+    from studio.utils.aws import (
+        add_users_to_ddb,
+        clear_ddb,
+        create_sagemaker_spaces,
+        create_sagemaker_team_spaces,
+        create_sagemaker_user_profiles,
+        enable_ttl,
+        get_client,
+        get_user_items_from_ddb,
+        record_created_resources,
+    )
+    from studio.utils.status import wait_until_ready
+
+    sharded = workers > 1 or run_id
+    if sharded and config.fan_out:
+        raise click.UsageError("Sharded runs work against one profile at a time")
+    if sharded and jit:
+        raise click.UsageError("--jit only stores the users, there's nothing to shard")
+
+    access_window = None
+    if access_end:
+        start = int((access_start or datetime.now()).timestamp())
+        end = int(access_end.timestamp())
+        if end <= start:
+            raise click.BadParameter(
+                "Must be after the start of the access window", param_hint="--access-end"
+            )
+        access_window = {
+            "start": start,
+            "end": end,
+            "expires": end + retention_days * 24 * 60 * 60,
+        }
+    elif access_start:
+        raise click.BadParameter(
+            "--access-end is required with --access-start", param_hint="--access-end"
+        )
 
-    click.echo("\n** Setting up users... **")
+    if access_window:
+        # Tables created before access windows existed have no TTL. Users would never expire
+        tables = {
+            (profile_config.region, profile_config.table_name)
+            for profile_config in map(config.for_profile, config.selected_profiles)
+        }
+        for region, table in sorted(tables):
+            enable_ttl(get_client("dynamodb", region), table)
+
+    if sharded:
+        # The first worker clears the users of the domain, keeping the leases of the run
+        click.echo("\n** Setting up users in a sharded run... **")
+        setup = {
+            "users": get_users(config, path),
+            "space_mode": space_mode,
+            "access_window": access_window,
+        }
+        run_progress = run_sharded_command(
+            config, "setup-users", setup, run_id, shards, workers
+        )
+        if run_progress["running"]:
+            # The last host to finish marks the users ready
+            return
+
+        # Once for the whole run, so shards don't hold their lease while SageMaker catches up
+        in_progress = {
+            user_email: item
+            for user_email, item in get_user_items_from_ddb(config).items()
+            if item.get("provisioning-status") == "in-progress"
+        }
+        with Progress("Waiting for users") as progress:
+            wait_until_ready(config, in_progress, progress)
+        return
 
     # Get users from provided csv
     users = get_users(config, path)
 
-    # Create SM user profiles for each participant
-    create_sagemaker_user_profiles(config, users.keys())
+    assignments = {config.profile: users}
+    if config.fan_out:
+        profiles = {name: config.profiles[name] for name in config.selected_profiles}
+        assignments = assign_users_to_profiles(users, profiles, assign)
+
+        for name, domain_users in assignments.items():
+            click.echo(
+                f"{name} ({profiles[name]['domain_id']}): {len(domain_users)} users "
+                f"in {len(set(domain_users.values()))} teams"
+            )
+
+    # Reset DynamoDB, one domain after the other before any users are stored. Domains in
+    # one region share a table, and a team moved between domains must not be deleted by
+    # its old domain's clear after its new domain stored it
+    for name in config.selected_profiles:
+        clear_ddb(config.for_profile(name))
+
+    def setup_domain(domain_config):
+        """Sets up the users assigned to one domain"""
+        domain_users = assignments[domain_config.profile]
+
+        if jit:
+            # No-shows never cost any time or quota
+            add_users_to_ddb(
+                domain_config, domain_users, space_mode, access_window, "on-demand"
+            )
+            click.echo(
+                f"{len(domain_users)} users will be set up on their first login through the web app."
+            )
+            return
+
+        # Store users in DDB first, so their provisioning status can be tracked
+        items = add_users_to_ddb(domain_config, domain_users, space_mode, access_window)
+
+        click.echo("\n** Setting up users... **")
+
+        # Spaces are only added once the profiles are created. Count them in the ETA from the start
+        if space_mode == "team":
+            progress.expect("spaces", len(set(domain_users.values())))
+        else:
+            progress.expect("spaces", len(domain_users))
+
+        # Create SM user profiles for each participant
+        failed_profiles = create_sagemaker_user_profiles(
+            domain_config, domain_users.keys(), progress
+        )
 
-    # Create SM Space for each user
-    create_sagemaker_spaces(config, users.keys())
+        if space_mode == "team":
+            # Create one shared SM Space for each team
+            failed_spaces = create_sagemaker_team_spaces(
+                domain_config, domain_users, progress
+            )
+        else:
+            # Create SM Space for each user
+            failed_spaces = create_sagemaker_spaces(
+                domain_config, domain_users.keys(), progress
+            )
+
+        in_progress = record_created_resources(
+            domain_config, items, failed_profiles, failed_spaces
+        )
+
+        # Users are only ready once SageMaker has their profile and spaces InService
+        wait_until_ready(domain_config, in_progress, progress)
 
-    # Store users in DDB for downstream usage.
-    add_users_to_ddb(config, users)
+    with Progress("Setting up users") as progress:
+        run_for_profiles(config, setup_domain)
 
 
 @cli.command()
 @pass_config
 @require_cli_config
-def get_urls(config):
+@click.option(
+    "-l",
+    "--landing",
+    type=click.Choice(LANDING_CHOICES),
+    help="Where participants land. Defaults to their team's space for users set up with "
+    "--space-mode team, the Studio home page otherwise. Falls back to the home page if their space isn't ready",
+)
+def get_urls(config, landing):
     """Get login urls for each user profile"""
     click.echo("Getting presigned urls... ")
 
-    # Get users from state in DDB
-    users = get_users_from_ddb(config)
+    result = None
+    # A quick ping first, so a wedged daemon doesn't hold up get-urls for long
+    if request_daemon(config, "ping") is not None:
+        result = request_daemon(config, "get-urls", {"landing": landing})
 
-    # Get presigned urls
-    urls = get_presigned_urls(config, users)
+    if result is not None:
+        urls = result["urls"]
+    else:
+        urls = get_presigned_urls_directly(config, landing)
 
     if urls:
         click.echo("Presigned URLs: \n")
@@ -108,29 +529,245 @@ def get_urls(config):
         click.echo(json.dumps(urls, indent=2))
 
 
+def get_presigned_urls_directly(config, landing):
+    """Gets presigned urls for the users of all selected profiles without the daemon"""
+    from studio.utils.aws import (
+        get_presigned_urls,
+        get_space_mode,
+        get_user_items_from_ddb,
+    )
+
+    def get_domain_urls(domain_config):
+        """Gets presigned urls for the users in one domain"""
+        # Get users from state in DDB
+        user_items = get_user_items_from_ddb(domain_config)
+        users = {user_email: item["team"] for user_email, item in user_items.items()}
+
+        # Get presigned urls
+        return get_presigned_urls(
+            domain_config, users, landing, progress, get_space_mode(user_items)
+        )
+
+    with Progress("Getting presigned urls") as progress:
+        results = run_for_profiles(config, get_domain_urls)
+
+    urls = {}
+    for domain_urls in results.values():
+        urls.update(domain_urls)
+
+    return urls
+
+
 @cli.command()
 @pass_config
 @require_cli_config
-def purge(config):
-    """Deletes all Hackathon SM User profiles, running SM apps, SM spaces etc."""
-    deleted_all_apps = False
-    deleted_all_spaces = False
-    deleted_all_users = False
+@click.option("-w", "--watch", is_flag=True, help="Keep refreshing the status")
+@click.option(
+    "-i",
+    "--interval",
+    type=click.IntRange(min=1),
+    default=5,
+    show_default=True,
+    help="Seconds between refreshes in watch mode",
+)
+def status(config, watch, interval):
+    """Shows provisioning and app status per team"""
+    if request_daemon(config, "ping") is not None:
+        if show_daemon_status(config, watch, interval):
+            return
+
+    from studio.utils.aws import (
+        get_domain_snapshot,
+        get_space_mode,
+        get_user_items_from_ddb,
+    )
+    from studio.utils.status import format_status, merge_summaries, summarize_status
+
+    def get_roster(domain_config):
+        """Gets the users and space mode of one domain"""
+        user_items = get_user_items_from_ddb(domain_config)
+        users = {user_email: item["team"] for user_email, item in user_items.items()}
+        return users, get_space_mode(user_items)
 
-    # Delete running SM apps in the SM domain
-    deleted_all_apps = delete_apps(config)
+    # The roster doesn't change during an event, only SageMaker state is refreshed
+    rosters = run_for_profiles(config, get_roster)
 
-    if deleted_all_apps:
-        # Delete SM spaces in the SM domain
-        deleted_all_spaces = delete_spaces(config)
+    # Each refresh in watch mode only lists what changed since the previous snapshot
+    snapshots = {}
 
-    if deleted_all_spaces:
-        # Delete SM user profiles
-        deleted_all_users = delete_users(config)
+    def get_domain_status(domain_config):
+        """Summarizes the status of one domain"""
+        users, space_mode = rosters[domain_config.profile]
+        snapshot = get_domain_snapshot(domain_config, snapshots.get(domain_config.profile))
+        snapshots[domain_config.profile] = snapshot
+        return summarize_status(snapshot, users, space_mode)
 
-    if deleted_all_users:
-        # Reset DynamoDB
-        clear_ddb(config)
+    previous = None
+    previous_domains = {}
+
+    try:
+        while True:
+            summaries = run_for_profiles(config, get_domain_status)
+
+            if watch:
+                click.clear()
+                click.secho(
+                    f"Status at {time.strftime('%H:%M:%S')} (refreshing every {interval}s, Ctrl+C to stop)\n",
+                    fg="cyan",
+                )
+
+            if config.fan_out:
+                for name, domain_summary in summaries.items():
+                    click.secho(f"{name} ({config.profiles[name]['domain_id']})", fg="cyan")
+                    click.echo(format_status(domain_summary, previous_domains.get(name)))
+                    click.echo()
+
+                summary = merge_summaries(list(summaries.values()))
+                click.secho("All domains", fg="cyan")
+            else:
+                summary = summaries[config.profile]
+
+            click.echo(format_status(summary, previous))
+
+            if not watch:
+                break
+
+            previous = summary
+            previous_domains = summaries
+
+            time.sleep(interval)
+
+    except KeyboardInterrupt:
+        # Stopped in the middle of a refresh or between two
+        pass
+
+
+def show_daemon_status(config, watch, interval):
+    """Shows the status from the daemon's cached domain state
+
+    Returns:
+        bool: False if the daemon stopped answering, to carry on without it
+    """
+    previous = None
+
+    try:
+        while True:
+            # The daemon refreshes in the background. In watch mode, never show state older than a refresh
+            result = request_daemon(
+                config,
+                "status",
+                {"previous": previous, "max_age": interval if watch else None},
+            )
+            if result is None:
+                return False
+
+            if watch:
+                click.clear()
+                click.secho(
+                    f"Status at {time.strftime('%H:%M:%S')} (refreshing every {interval}s, Ctrl+C to stop)\n",
+                    fg="cyan",
+                )
+            elif config.verbose:
+                click.secho(
+                    f"Domain state from the daemon, {result['snapshot_age']:.0f}s old\n",
+                    fg="cyan",
+                )
+
+            click.echo(result["output"])
+
+            if not watch:
+                break
+
+            previous = result["summary"]
+
+            time.sleep(interval)
+
+    except KeyboardInterrupt:
+        # Stopped in the middle of a refresh or between two
+        pass
+
+    return True
+
+
+@cli.command()
+@pass_config
+@require_cli_config
+@sharding_options
+def purge(config, workers, shards, run_id):
+    """Deletes all Hackathon SM User profiles, running SM apps, SM spaces etc."""
+    from studio.utils.aws import (
+        clear_ddb,
+        delete_apps,
+        delete_spaces,
+        delete_users,
+        get_domain_snapshot,
+        list_event_resources,
+    )
+
+    sharded = workers > 1 or run_id
+    if sharded and config.fan_out:
+        raise click.UsageError("Sharded runs work against one profile at a time")
+
+    def purge_domain(domain_config):
+        """Deletes everything in one domain
+
+        Returns True if it's all gone, or None if other hosts are still purging it in a sharded run
+        """
+        deleted_all_apps = False
+        deleted_all_spaces = False
+        deleted_all_users = False
+        purge_run_id = None
+
+        if sharded:
+            # Apps, spaces and user profiles are deleted in order within each shard
+            run_progress = run_sharded_command(
+                domain_config,
+                "purge",
+                get_domain_snapshot(domain_config),
+                run_id,
+                shards,
+                workers,
+            )
+            if run_progress["running"] and not (
+                run_progress["failed"] or run_progress["expired"]
+            ):
+                # The last host to finish reports the outcome and clears DDB
+                return None
+
+            deleted_all_users = run_progress["done"] == run_progress["shards"]
+            purge_run_id = run_progress["run_id"]
+
+        else:
+            # Only this event's resources if it has an ID, otherwise everything in the domain
+            resources = {"apps": None, "spaces": None, "user_profiles": None}
+            if domain_config.event_id:
+                resources = list_event_resources(domain_config)
+
+            # Delete running SM apps in the SM domain
+            deleted_all_apps = delete_apps(domain_config, resources["apps"], progress)
+
+            if deleted_all_apps:
+                # Delete SM spaces in the SM domain
+                deleted_all_spaces = delete_spaces(
+                    domain_config, resources["spaces"], progress
+                )
+
+            if deleted_all_spaces:
+                # Delete SM user profiles
+                deleted_all_users = delete_users(
+                    domain_config, resources["user_profiles"], progress
+                )
+
+        if deleted_all_users:
+            # Reset DynamoDB, along with the leases of this run
+            clear_ddb(domain_config, run_id=purge_run_id)
+
+        return deleted_all_users
+
+    with Progress("Purging") as progress:
+        results = run_for_profiles(config, purge_domain)
+
+    if all(results.values()):
         click.secho(
             "\nAll SageMaker assets have been deleted. If you've deployed a frontend don't forget to delete that as well.\n",
             fg="yellow",
@@ -138,6 +775,167 @@ def purge(config):
 
     # users = get_users_from_ddb(config)
 
-    else:
+    elif False in results.values():
+        if config.fan_out:
+            failed = [name for name, deleted_all in results.items() if deleted_all is False]
+            click.secho(f"\n\nDomains not completely purged: {', '.join(failed)}", fg="red")
         click.secho("\n\nCould not completely purge the environment", fg="red")
         click.secho("Try running the purge command again in a minute or two.", fg="red")
+
+
+@cli.command()
+@pass_config
+@require_cli_config
+@click.option(
+    "--rate",
+    type=click.FloatRange(min=0),
+    default=2,
+    show_default=True,
+    help="Apps stopped per second. 0 for no limit",
+)
+def suspend(config, rate):
+    """Stops all running apps, keeping spaces and their storage"""
+    from studio.utils.suspend import suspend_apps
+
+    def suspend_domain(domain_config):
+        """Suspends the running apps in one domain"""
+        return suspend_apps(domain_config, rate, progress)
+
+    with Progress("Suspending") as progress:
+        results = run_for_profiles(config, suspend_domain)
+
+    if all(results.values()):
+        click.secho(
+            "\nAll apps are stopped. Run 'studio resume' to restart them.", fg="cyan"
+        )
+    else:
+        click.secho("\nCould not stop all apps. Run suspend again to retry.", fg="red")
+
+
+@cli.command()
+@pass_config
+@require_cli_config
+@click.option("--team", "teams", multiple=True, help="Only resume this team. Repeatable")
+@click.option(
+    "--user", "users", multiple=True, help="Only resume this user (email). Repeatable"
+)
+@click.option(
+    "--wave-size",
+    type=click.IntRange(min=1),
+    default=25,
+    show_default=True,
+    help="Number of apps started per wave",
+)
+@click.option(
+    "--wave-interval",
+    type=click.IntRange(min=0),
+    default=30,
+    show_default=True,
+    help="Seconds between waves",
+)
+def resume(config, teams, users, wave_size, wave_interval):
+    """Restarts the apps stopped by suspend"""
+    from studio.utils.suspend import resume_apps
+
+    def resume_domain(domain_config):
+        """Resumes the suspended apps in one domain"""
+        return resume_apps(
+            domain_config, teams, users, wave_size, wave_interval, progress
+        )
+
+    with Progress("Resuming") as progress:
+        run_for_profiles(config, resume_domain)
+
+
+@cli.command()
+@pass_config
+@require_cli_config
+@click.argument("run_id")
+def run_status(config, run_id):
+    """Shows the progress of a sharded run"""
+    from studio.utils.shards import format_run_progress, get_run_progress
+
+    click.secho(format_run_progress(run_id, get_run_progress(config, run_id)), fg="cyan")
+
+
+@cli.command()
+@pass_config
+@require_cli_config
+@click.option(
+    "--refresh-interval",
+    type=click.IntRange(min=1),
+    default=10,
+    show_default=True,
+    help="Seconds between refreshes of the cached domain state",
+)
+def daemon(config, refresh_interval):
+    """Serves get-urls and status from warm clients and cached state"""
+    from studio.utils.daemon import Daemon
+
+    if config.fan_out:
+        raise click.UsageError("Start one daemon per profile")
+
+    Daemon(config, refresh_interval).serve()
+
+
+@cli.group()
+def state():
+    """Exports and imports the event state in DynamoDB"""
+
+
+@state.command("export")
+@pass_config
+@require_cli_config
+@click.argument("path", type=click.Path(dir_okay=False, writable=True))
+@click.option(
+    "--segments",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="Number of parallel scan segments",
+)
+def export_state(config, path, segments):
+    """Exports the DDB table to PATH (gzipped if it ends with .gz)"""
+    from studio.utils.state import export_state
+
+    start = time.time()
+    count = export_state(config, path, segments)
+
+    click.secho(
+        f"Exported {count} items from {config.table_name} to {path} in {time.time() - start:.1f}s",
+        fg="cyan",
+    )
+
+
+@state.command("import")
+@pass_config
+@require_cli_config
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=5,
+    show_default=True,
+    help="Number of concurrent batch writers",
+)
+@click.option(
+    "--max-wcu",
+    type=click.IntRange(min=0),
+    help="Write capacity units per second to stay under. Defaults to the table's provisioned capacity",
+)
+@click.option("--clear", is_flag=True, help="Clear the DDB table before importing")
+def import_state(config, path, workers, max_wcu, clear):
+    """Imports a state file created by 'studio state export'"""
+    from studio.utils.aws import clear_ddb
+    from studio.utils.state import import_state
+
+    if clear:
+        clear_ddb(config)
+
+    start = time.time()
+    count = import_state(config, path, workers, max_wcu)
+
+    click.secho(
+        f"Imported {count} items into {config.table_name} in {time.time() - start:.1f}s",
+        fg="cyan",
+    )
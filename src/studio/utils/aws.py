@@ -1,5 +1,6 @@
 import boto3
 import botocore
+import botocore.config
 import click
 import time
 import re
@@ -7,6 +8,129 @@ import sys
 import threading
 
 from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from studio.utils.progress import Progress
+from studio.utils.throttle import RateLimiter
+
+# Keys of DDB items that aren't users (i.e shard leases) start with this.
+# Emails can't, so they never collide with the roster.
+INTERNAL_KEY_PREFIX = "#"
+
+# Provisioning status of each user in DDB, updated as setup-users proceeds:
+# pending -> in-progress once the user profile and spaces are created -> ready once
+# SageMaker reports all of them InService, or failed.
+# Users set up just in time are on-demand until their first login, and preparing
+# while the web app creates their user profile and spaces.
+PROVISIONING_STATUSES = [
+    "pending",
+    "in-progress",
+    "on-demand",
+    "preparing",
+    "ready",
+    "failed",
+]
+
+# DynamoDB deletes items once the epoch time in this attribute has passed
+TTL_ATTRIBUTE = "expires-at"
+
+# Tags put on every user profile and space, so an event's resources can be found
+# through the tagging API. Apps inherit the tags of the space they run in.
+EVENT_TAG_KEY = "studio-cli:event-id"
+RESOURCE_NAME_TAG_KEY = "studio-cli:resource-name"
+
+# App types are lowercased in app ARNs
+APP_TYPES = {
+    app_type.lower(): app_type
+    for app_type in [
+        "JupyterLab",
+        "CodeEditor",
+        "JupyterServer",
+        "KernelGateway",
+        "RStudioServerPro",
+        "RSessionGateway",
+        "Canvas",
+    ]
+}
+
+# The tagging API can take this long to return newly created resources.
+# Resources created since are matched against the event's users in DDB instead.
+TAGGING_LAG = timedelta(minutes=15)
+
+# Whether each resource listed in a domain belongs to an event, cached per process:
+# {('domain id', 'event id'): {'user_profiles': {'name': bool}, 'spaces': {'name': bool}}}
+# Tags are set on creation, so classifying a resource once is enough.
+event_resource_names = {}
+event_resource_names_lock = threading.Lock()
+
+# Refreshed snapshots re-list what was modified this long before the last refresh,
+# and are listed in full again after FULL_SNAPSHOT_SECONDS
+SNAPSHOT_OVERLAP = timedelta(seconds=30)
+FULL_SNAPSHOT_SECONDS = 60
+
+# Enough connections for every thread of the thread pools sharing a client
+MAX_POOL_CONNECTIONS = 25
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+# boto3 resources aren't thread-safe, so each thread keeps its own
+_resources = threading.local()
+
+
+def get_client(service: str, region: str):
+    """Gets a boto3 client, reusing the one created earlier in this process
+
+    Clients are thread-safe, so one client per service and region is shared by
+    all threads. Long-running processes like the daemon keep their connections
+    warm this way.
+
+    Parameters:
+        service (str): AWS service, i.e 'sagemaker'
+        region (str): AWS Region to use
+
+    Returns:
+        boto3 client
+    """
+
+    with _clients_lock:
+        if (service, region) not in _clients:
+            _clients[(service, region)] = boto3.client(
+                service,
+                region,
+                config=botocore.config.Config(
+                    max_pool_connections=MAX_POOL_CONNECTIONS
+                ),
+            )
+
+        return _clients[(service, region)]
+
+
+def get_resource(service: str, region: str):
+    """Gets a boto3 resource, reusing the one this thread created earlier
+
+    Like get_client, so the daemon's refreshes reuse warm DynamoDB connections.
+
+    Parameters:
+        service (str): AWS service, i.e 'dynamodb'
+        region (str): AWS Region to use
+
+    Returns:
+        boto3 resource
+    """
+
+    if not hasattr(_resources, "by_key"):
+        _resources.by_key = {}
+
+    resources = _resources.by_key
+    if (service, region) not in resources:
+        resources[(service, region)] = boto3.resource(
+            service,
+            region,
+            config=botocore.config.Config(max_pool_connections=MAX_POOL_CONNECTIONS),
+        )
+
+    return resources[(service, region)]
 
 
 def get_username_from_email(email: str) -> str:
@@ -51,147 +175,521 @@ def get_code_editor_space_name(username: str) -> str:
     return space_name
 
 
-def create_sagemaker_user_profiles(config: object, users: list) -> None:
+def get_team_space_name(team: int) -> str:
+    """Gets the name of the space shared by a team
+
+    Parameters:
+        team (int): team number
+
+    Returns:
+        str: space name
+    """
+    space_name = f"team-{team}-space"
+
+    return space_name
+
+
+def get_team_space_owners(users: dict) -> dict:
+    """Picks the owner of each team's shared space
+
+    Parameters:
+        users (dict): {'email':'team'}
+
+    Returns:
+        dict: {team: 'username'}. The first team member in alphabetical order owns the space
+    """
+
+    owners = {}
+    for user_email in sorted(users):
+        owners.setdefault(users[user_email], get_username_from_email(user_email))
+
+    return owners
+
+
+def get_user_space_names(user_email: str, team, space_mode: str = "user") -> list:
+    """Gets the names of the spaces a user needs
+
+    Parameters:
+        user_email (str): Email of the user
+        team: Team of the user
+        space_mode (str): One of SPACE_MODES. In team mode each user needs their team's space
+
+    Returns:
+        list: Space names
+    """
+
+    if space_mode == "team":
+        return [get_team_space_name(team)]
+
+    username = get_username_from_email(user_email)
+    return [get_jupyter_space_name(username), get_code_editor_space_name(username)]
+
+
+def get_event_tags(config: object, resource_name: str) -> dict:
+    """Gets the tag parameter for a resource created for the configured event
+
+    Parameters:
+        config (object): CLI configuration object.
+        resource_name (str): Name of the user profile or space
+
+    Returns:
+        dict: {'Tags': [...]} to pass to the create call, or {} if no event ID is configured
+    """
+
+    if not config.event_id:
+        return {}
+
+    return {
+        "Tags": [
+            {"Key": EVENT_TAG_KEY, "Value": config.event_id},
+            {"Key": RESOURCE_NAME_TAG_KEY, "Value": resource_name},
+        ]
+    }
+
+
+def create_sagemaker_user_profiles(
+    config: object, users: list, progress: Progress = None
+) -> None:
     """Create SageMaker Studio user profiles
 
     Parameters:
         config (object): CLI configuration object.
         users (list): List of user emails
+        progress (Progress): (optional) Tracks progress under 'profiles'
 
     Returns:
-        None
+        set: Emails of the users whose profile could not be created
     """
 
-    sm_client = boto3.client("sagemaker", config.region)
+    sm_client = get_client("sagemaker", config.region)
+    progress = progress or Progress()
+
+    def create_user_profile(user_email: str) -> bool:
+        """Creates one user profile, unless it already exists"""
+
+        username = get_username_from_email(user_email)
+        try:
+            sm_client.describe_user_profile(
+                DomainId=config.domain_id, UserProfileName=username
+            )
+
+        except sm_client.exceptions.ResourceNotFound:
+            # User does not exist. Creating user.
 
-    with click.progressbar(users, label="Creating SM user profiles") as users_list:
-        for user_email in users_list:
-            username = get_username_from_email(user_email)
             try:
-                sm_client.describe_user_profile(
-                    DomainId=config.domain_id, UserProfileName=username
+                sm_client.create_user_profile(
+                    DomainId=config.domain_id,
+                    UserProfileName=username,
+                    **get_event_tags(config, username),
                 )
 
-            except sm_client.exceptions.ResourceNotFound:
-                # User does not exist. Creating user.
+            except sm_client.exceptions.ResourceLimitExceeded:
+                click.secho(
+                    f'You have reached the maximum allowed SageMaker users! You need to submit a quota increase request: "Maximum number of Studio user profiles allowed per account"',
+                    fg="red",
+                )
+                sys.exit(1)
 
-                try:
-                    sm_client.create_user_profile(
-                        DomainId=config.domain_id, UserProfileName=username
-                    )
+            except:
+                click.secho(
+                    f"User with name '{user_email}' could not be created for some reason. Skipping",
+                    fg="red",
+                )
+                return False
 
-                except sm_client.exceptions.ResourceLimitExceeded:
-                    click.secho(
-                        f'You have reached the maximum allowed SageMaker users! You need to submit a quota increase request: "Maximum number of Studio user profiles allowed per account"',
-                        fg="red",
-                    )
-                    sys.exit(1)
+        return True
 
-                except:
-                    click.secho(
-                        f"User with name '{user_email}' could not be created for some reason. Skipping",
-                        fg="red",
-                    )
-    return
+    users = list(users)
+    progress.add("profiles", len(users))
+    failed = set()
+    for user_email in users:
+        if not progress.track("profiles", create_user_profile)(user_email):
+            failed.add(user_email)
 
+    return failed
 
-def create_sagemaker_spaces(config: object, users_email_list: list) -> None:
+
+def create_sagemaker_spaces(
+    config: object, users_email_list: list, progress: Progress = None
+) -> None:
     """Create SageMaker Studio Domain spaces for each user in the users_email_list
 
     Parameters:
         config (object): CLI configuration object.
         users_email_list (list): List of user emails
+        progress (Progress): (optional) Tracks progress under 'spaces'
     Returns:
-        None
+        set: Emails of the users whose spaces could not be created
     """
 
-    sm_client = boto3.client("sagemaker", config.region)
+    sm_client = get_client("sagemaker", config.region)
+    progress = progress or Progress()
 
-    with click.progressbar(
-        users_email_list, label="Creating stopped instances for notebooks and editors"
-    ) as user_emails:
-        for user_email in user_emails:
-            username = get_username_from_email(user_email)
-            jupyter_space_name = get_jupyter_space_name(username)
-            ce_space_name = get_code_editor_space_name(username)
+    def create_spaces(user_email: str) -> bool:
+        """Creates the Jupyter and Code Editor spaces of one user, unless they exist"""
+
+        username = get_username_from_email(user_email)
+        jupyter_space_name = get_jupyter_space_name(username)
+        ce_space_name = get_code_editor_space_name(username)
+        try:
+            sm_client.describe_space(
+                DomainId=config.domain_id, SpaceName=jupyter_space_name
+            )
+        except sm_client.exceptions.ResourceNotFound:
+            # Space does not exist. Create space
             try:
-                sm_client.describe_space(
-                    DomainId=config.domain_id, SpaceName=jupyter_space_name
+                sm_client.create_space(
+                    DomainId=config.domain_id,
+                    SpaceName=jupyter_space_name,
+                    OwnershipSettings={"OwnerUserProfileName": username},
+                    SpaceSettings={"AppType": "JupyterLab"},
+                    SpaceSharingSettings={"SharingType": "Private"},
+                    **get_event_tags(config, jupyter_space_name),
                 )
-            except sm_client.exceptions.ResourceNotFound:
-                # Space does not exist. Create space
-                try:
-                    sm_client.create_space(
-                        DomainId=config.domain_id,
-                        SpaceName=jupyter_space_name,
-                        OwnershipSettings={"OwnerUserProfileName": username},
-                        SpaceSettings={"AppType": "JupyterLab"},
-                        SpaceSharingSettings={"SharingType": "Private"},
-                    )
 
-                    sm_client.create_space(
-                        DomainId=config.domain_id,
-                        SpaceName=ce_space_name,
-                        OwnershipSettings={"OwnerUserProfileName": username},
-                        SpaceSettings={"AppType": "CodeEditor"},
-                        SpaceSharingSettings={"SharingType": "Private"},
-                    )
-                except sm_client.exceptions.ResourceLimitExceeded:
-                    click.secho(
-                        f"\nYou have reached the maximum allowed SageMaker spaces! You need to submit a quota increase request!",
-                        fg="red",
-                    )
-                    sys.exit(1)
-                    return False
+                sm_client.create_space(
+                    DomainId=config.domain_id,
+                    SpaceName=ce_space_name,
+                    OwnershipSettings={"OwnerUserProfileName": username},
+                    SpaceSettings={"AppType": "CodeEditor"},
+                    SpaceSharingSettings={"SharingType": "Private"},
+                    **get_event_tags(config, ce_space_name),
+                )
+            except sm_client.exceptions.ResourceLimitExceeded:
+                click.secho(
+                    f"\nYou have reached the maximum allowed SageMaker spaces! You need to submit a quota increase request!",
+                    fg="red",
+                )
+                sys.exit(1)
+                return False
 
-                except Exception as e:
-                    click.secho(
-                        f"Space with name '{username}' could not be created for some reason. Skipping\n\n {str(e)}",
-                        fg="red",
-                    )
+            except Exception as e:
+                click.secho(
+                    f"Space with name '{username}' could not be created for some reason. Skipping\n\n {str(e)}",
+                    fg="red",
+                )
+                return False
+
+        return True
+
+    users_email_list = list(users_email_list)
+    progress.add("spaces", len(users_email_list))
+    failed = set()
+    for user_email in users_email_list:
+        if not progress.track("spaces", create_spaces)(user_email):
+            failed.add(user_email)
+
+    return failed
+
+
+def create_sagemaker_team_spaces(
+    config: object, users: dict, progress: Progress = None
+) -> None:
+    """Create one shared SageMaker Studio space per team
+
+    Parameters:
+        config (object): CLI configuration object.
+        users (dict): {'email':'team'}
+        progress (Progress): (optional) Tracks progress under 'spaces'
+    Returns:
+        set: Emails of the members of teams whose space could not be created
+    """
+
+    sm_client = get_client("sagemaker", config.region)
+    progress = progress or Progress()
+
+    def create_team_space(team: int, owner: str) -> bool:
+        """Creates the shared space of one team, unless it exists"""
+
+        space_name = get_team_space_name(team)
+        try:
+            sm_client.describe_space(DomainId=config.domain_id, SpaceName=space_name)
+        except sm_client.exceptions.ResourceNotFound:
+            # Space does not exist. Create space
+            try:
+                sm_client.create_space(
+                    DomainId=config.domain_id,
+                    SpaceName=space_name,
+                    OwnershipSettings={"OwnerUserProfileName": owner},
+                    SpaceSettings={"AppType": "JupyterLab"},
+                    SpaceSharingSettings={"SharingType": "Shared"},
+                    **get_event_tags(config, space_name),
+                )
+            except sm_client.exceptions.ResourceLimitExceeded:
+                click.secho(
+                    f"\nYou have reached the maximum allowed SageMaker spaces! You need to submit a quota increase request!",
+                    fg="red",
+                )
+                sys.exit(1)
+
+            except Exception as e:
+                click.secho(
+                    f"Space for team '{team}' could not be created for some reason. Skipping\n\n {str(e)}",
+                    fg="red",
+                )
+                return False
 
-    return
+        return True
 
+    owners = get_team_space_owners(users)
+    progress.add("spaces", len(owners))
+    failed = set()
+    for team, owner in owners.items():
+        if not progress.track("spaces", create_team_space)(team, owner):
+            failed.update(
+                user_email for user_email in users if users[user_email] == team
+            )
+
+    return failed
+
+
+def add_users_to_ddb(
+    config: object,
+    users: object,
+    space_mode: str = "user",
+    access_window: dict = None,
+    provisioning_status: str = "pending",
+) -> dict:
+    """Stores all users and teams in DDB for easier state management
+
+    Users are stored as pending before anything is created, so the web app can
+    tell participants their environment isn't ready yet.
+
+    Parameters:
+        config (object): CLI configuration object.
+        users (object): {'email':'team'}
+        space_mode (str): One of SPACE_MODES. Tells downstream users which space to land in
+        access_window (dict): (optional) {'start': epoch, 'end': epoch, 'expires': epoch}.
+            The web app only issues URLs between start and end, and DynamoDB deletes the users once expired
+        provisioning_status (str): One of PROVISIONING_STATUSES. 'on-demand' leaves provisioning to the web app
 
-def add_users_to_ddb(config: object, users: object) -> None:
-    """Stores all users and teams in DDB for easier state management"""
+    Returns:
+        dict: {'email': item} as stored, to pass on to update_user_items
+    """
 
-    ddb_client = boto3.resource("dynamodb", config.region)
+    ddb_client = get_resource("dynamodb", config.region)
     table_resource = ddb_client.Table(config.table_name)
+    now = int(time.time())
+
+    extra = {}
+    if config.event_id:
+        # Lets the web app tag what it creates for on-demand users
+        extra["event-id"] = config.event_id
+    if access_window:
+        extra.update(
+            {
+                "access-start": access_window["start"],
+                "access-end": access_window["end"],
+                TTL_ATTRIBUTE: access_window["expires"],
+            }
+        )
+
+    items = {
+        user_email: {
+            "pk": user_email,
+            "team": team,
+            "domain-id": config.domain_id,
+            "space-mode": space_mode,
+            "username": get_username_from_email(user_email),
+            "provisioning-status": provisioning_status,
+            "registered-at": now,
+            "updated-at": now,
+            **extra,
+        }
+        for user_email, team in users.items()
+    }
+
     try:
         with table_resource.batch_writer() as batch:
-            for user_email, team in users.items():
-                batch.put_item(
-                    Item={"pk": user_email, "team": team, "domain-id": config.domain_id}
-                )
+            for item in items.values():
+                batch.put_item(Item=item)
         click.echo("Users persisted in DynamoDB.")
     except Exception as e:
         click.secho(e)
 
+    return items
+
+
+def update_user_items(config: object, items: dict, updates: dict) -> None:
+    """Stores changes to users' items in DDB, 25 users per request
+
+    The items are written again as a whole, keeping everything else, like
+    when they were registered, as it was.
+
+    Parameters:
+        config (object): CLI configuration object.
+        items (dict): {'email': item} as returned by add_users_to_ddb or get_user_items_from_ddb. Updated in place
+        updates (dict): {'email': {'attribute': value}}
+
+    Returns:
+        None
+    """
+
+    table_resource = get_resource("dynamodb", config.region).Table(config.table_name)
+    now = int(time.time())
+
+    with table_resource.batch_writer() as batch:
+        for user_email, attributes in updates.items():
+            item = items[user_email]
+            item.update(attributes)
+            item["updated-at"] = now
+            batch.put_item(Item=item)
+
 
-def get_presigned_urls(config: object, users: list) -> list:
-    """get presigned login URL for each user"""
+def record_created_resources(
+    config: object, items: dict, failed_profiles: set, failed_spaces: set
+) -> dict:
+    """Stores which users' profile and spaces were created
 
-    sm_client = boto3.client("sagemaker", config.region)
+    Users whose resources were all created are in-progress until SageMaker
+    reports them InService, see studio.utils.status.wait_until_ready.
+
+    Parameters:
+        config (object): CLI configuration object.
+        items (dict): {'email': item} as returned by add_users_to_ddb
+        failed_profiles (set): Emails of the users whose profile could not be created
+        failed_spaces (set): Emails of the users whose spaces could not be created
+
+    Returns:
+        dict: {'email': item} of the users that are in-progress
+    """
+
+    updates = {}
+    for user_email in items:
+        profile_failed = user_email in failed_profiles
+        space_failed = user_email in failed_spaces
+        updates[user_email] = {
+            "provisioning-status": "failed"
+            if profile_failed or space_failed
+            else "in-progress",
+            "profile-status": "failed" if profile_failed else "created",
+            "space-status": "failed" if space_failed else "created",
+        }
+
+    update_user_items(config, items, updates)
+
+    return {
+        user_email: item
+        for user_email, item in items.items()
+        if item["provisioning-status"] == "in-progress"
+    }
+
+
+def get_landing_target(landing: str, username: str, team: int = None) -> tuple:
+    """Gets the space and landing URI a presigned URL should point to
+
+    Parameters:
+        landing (str): One of LANDING_CHOICES
+        username (str): username
+        team (int): (optional) The user's team, if users share one space per team
+
+    Returns:
+        tuple: (space name, landing URI), or (None, None) for the Studio home page
+    """
+
+    if landing != "home" and team is not None:
+        # Team spaces are JupyterLab spaces
+        return get_team_space_name(team), "app:JupyterLab:"
+
+    if landing == "jupyter":
+        return get_jupyter_space_name(username), "app:JupyterLab:"
+
+    if landing == "code-editor":
+        return get_code_editor_space_name(username), "app:CodeEditor:"
+
+    return None, None
+
+
+def get_presigned_urls(
+    config: object,
+    users: list,
+    landing: str = None,
+    progress: Progress = None,
+    space_mode: str = "user",
+    spaces: list = None,
+) -> list:
+    """get presigned login URL for each user
+
+    Parameters:
+        config (object): CLI configuration object.
+        users (list): {'email':'team'}
+        landing (str): (optional) One of LANDING_CHOICES. Defaults to the team's space in team mode, the home page otherwise.
+            Users whose space isn't InService land on the Studio home page
+        progress (Progress): (optional) Tracks progress under 'urls'
+        space_mode (str): One of SPACE_MODES. In team mode users land in their team's space
+        spaces (list): (optional) Space summaries, i.e from a cached snapshot. Listed if not given
+
+    Returns:
+        dict: {'email':'url'}
+    """
+
+    if landing is None:
+        # Teams share their work in their space, take them straight there
+        landing = "jupyter" if space_mode == "team" else "home"
+
+    if space_mode == "team" and landing == "code-editor":
+        raise click.BadParameter(
+            "Users share one JupyterLab space per team, there's no Code Editor space to land in. Use 'jupyter' instead",
+            param_hint="--landing",
+        )
+
+    sm_client = get_client("sagemaker", config.region)
+    progress = progress or Progress()
+    progress.add("urls", len(users))
+
+    space_statuses = {}
+    if landing != "home":
+        if spaces is None:
+            # One paginated listing instead of describing every users space
+            spaces = list_domain_resources(
+                sm_client, "list_spaces", "Spaces", config.domain_id
+            )
+        space_statuses = {space["SpaceName"]: space["Status"] for space in spaces}
 
     users_to_urls = {}
     for user_email, team in users.items():
+        progress.start("urls")
         username = get_username_from_email(user_email)
-        # space_name = get_jupyter_space_name(username)
 
-        try:
-            response = sm_client.create_presigned_domain_url(
-                DomainId=config.domain_id,
-                UserProfileName=username,
-                SessionExpirationDurationInSeconds=43200,  # 3 days
-                ExpiresInSeconds=300,  # 5 minutes
-                # SpaceName=space_name,
-                # LandingUri="app:JupyterLab:",
+        params = {
+            "DomainId": config.domain_id,
+            "UserProfileName": username,
+            "SessionExpirationDurationInSeconds": 43200,  # 3 days
+            "ExpiresInSeconds": 300,  # 5 minutes
+        }
+
+        space_name, landing_uri = get_landing_target(
+            landing, username, team if space_mode == "team" else None
+        )
+        if space_name and space_statuses.get(space_name) == "InService":
+            params["SpaceName"] = space_name
+            params["LandingUri"] = landing_uri
+        elif space_name:
+            click.secho(
+                f"Space '{space_name}' is not ready. User '{username}' will land on the Studio home page",
+                fg="yellow",
             )
 
+        try:
+            try:
+                response = sm_client.create_presigned_domain_url(**params)
+            except botocore.exceptions.ClientError as e:
+                if "SpaceName" not in params or e.response["Error"]["Code"] not in [
+                    "ValidationException",
+                    "ResourceNotFound",
+                ]:
+                    raise
+
+                # Space went away after listing. Fall back to the home page
+                params.pop("SpaceName")
+                params.pop("LandingUri")
+                response = sm_client.create_presigned_domain_url(**params)
+
             users_to_urls[user_email] = response["AuthorizedUrl"]
+            progress.finish("urls")
 
         except sm_client.exceptions.ResourceNotFound as e:
+            progress.finish("urls", ok=False)
             click.secho(
                 f"Could not create presigned url for user '{username}' and space '{team}'",
                 fg="red",
@@ -201,11 +699,23 @@ def get_presigned_urls(config: object, users: list) -> list:
     return users_to_urls
 
 
-def delete_users(config: object) -> bool:
-    """Deletes all SageMaker user profiles"""
+def delete_users(
+    config: object, user_profiles: list = None, progress: Progress = None
+) -> bool:
+    """Deletes SageMaker user profiles
+
+    Parameters:
+        config (object): CLI configuration object.
+        user_profiles (list): (optional) User profile summaries to delete. Defaults to all user profiles in the domain
+        progress (Progress): (optional) Tracks progress under 'profiles'
+
+    Returns:
+        bool: True if all user profiles were deleted
+    """
     click.echo("\n** Deleting SageMaker user profiles... **")
 
-    sm_client = boto3.client("sagemaker", config.region)
+    sm_client = get_client("sagemaker", config.region)
+    progress = progress or Progress()
 
     def delete_user(user_profile: str, time_to_wait=2) -> None:
         """Deletes one user with retry"""
@@ -228,6 +738,7 @@ def delete_users(config: object) -> bool:
 
                 click.echo(f"Deleting user {user_profile_name} has failed. Retrying...")
 
+                progress.retry("profiles")
                 time.sleep(time_to_wait)
 
                 return delete_user(user_profile, time_to_wait * 1.5)
@@ -245,6 +756,7 @@ def delete_users(config: object) -> bool:
                     )
                     return False
 
+                progress.retry("profiles")
                 time.sleep(time_to_wait)
 
                 return delete_user(user_profile, time_to_wait * 1.5)
@@ -266,6 +778,7 @@ def delete_users(config: object) -> bool:
                         return False
 
                     click.echo(f"User {user_profile_name} is in use. Retrying...")
+                    progress.retry("profiles")
                     return delete_user(user_profile, time_to_wait * 1.5)
 
                 except sm_client.exceptions.ResourceNotFound:
@@ -279,6 +792,7 @@ def delete_users(config: object) -> bool:
                             "There's some throttling exceptions... Calming down a bit.",
                             fg="yellow",
                         )
+                        progress.throttle("profiles")
                         time.sleep(5)
                         return delete_user(user_profile, time_to_wait)
                     else:
@@ -300,24 +814,16 @@ def delete_users(config: object) -> bool:
             click.secho(f"Some resource limit have been exceeded! \n {e}", fg="red")
             sys.exit(1)
 
-    user_profiles = []
-    next_token = None
-
-    while True:
-        params = {"DomainIdEquals": config.domain_id}
-        if next_token:
-            params["NextToken"] = next_token
-
-        response = sm_client.list_user_profiles(**params)
-        user_profiles.extend(response["UserProfiles"])
+    if user_profiles is None:
+        user_profiles = list_domain_resources(
+            sm_client, "list_user_profiles", "UserProfiles", config.domain_id
+        )
 
-        next_token = response.get("NextToken")
-        if not next_token:
-            break
+    progress.add("profiles", len(user_profiles))
 
     # Parallelize the app deletion
     with ThreadPoolExecutor(max_workers=5) as executor:
-        results = executor.map(delete_user, user_profiles)
+        results = executor.map(progress.track("profiles", delete_user), user_profiles)
 
     deleted_all_users = all(results)
 
@@ -332,12 +838,22 @@ def delete_users(config: object) -> bool:
     return deleted_all_users
 
 
-def delete_spaces(config: object) -> bool:
-    """Deletes all SageMaker spaces related to the Domain ID in the config file"""
+def delete_spaces(config: object, spaces: list = None, progress: Progress = None) -> bool:
+    """Deletes SageMaker spaces related to the Domain ID in the config file
+
+    Parameters:
+        config (object): CLI configuration object.
+        spaces (list): (optional) Space summaries to delete. Defaults to all spaces in the domain
+        progress (Progress): (optional) Tracks progress under 'spaces'
+
+    Returns:
+        bool: True if all spaces were deleted
+    """
 
     click.echo("\n** Deleting all spaces in the domain... **")
 
-    sm_client = boto3.client("sagemaker", config.region)
+    sm_client = get_client("sagemaker", config.region)
+    progress = progress or Progress()
 
     def delete_space(space: object, time_to_wait=2):
         """Deletes a space with retry and waiting"""
@@ -371,6 +887,7 @@ def delete_spaces(config: object) -> bool:
                     )
                     return False
 
+                progress.retry("spaces")
                 time.sleep(time_to_wait)
                 return delete_space(space, time_to_wait * 1.5)
 
@@ -403,6 +920,7 @@ def delete_spaces(config: object) -> bool:
                             "There's some throttling exceptions... Calming down a bit.",
                             fg="yellow",
                         )
+                        progress.throttle("spaces")
                         time.sleep(5)
                         return delete_space(space, time_to_wait)
                     else:
@@ -413,24 +931,16 @@ def delete_spaces(config: object) -> bool:
             # Space already deleted.
             return True
 
-    spaces = []
-    next_token = None
-
-    while True:
-        params = {"DomainIdEquals": config.domain_id}
-        if next_token:
-            params["NextToken"] = next_token
+    if spaces is None:
+        spaces = list_domain_resources(
+            sm_client, "list_spaces", "Spaces", config.domain_id
+        )
 
-        response = sm_client.list_spaces(**params)
-        spaces.extend(response["Spaces"])
-
-        next_token = response.get("NextToken")
-        if not next_token:
-            break
+    progress.add("spaces", len(spaces))
 
     # Parallelize the app deletion
     with ThreadPoolExecutor(max_workers=5) as executor:
-        results = executor.map(delete_space, spaces)
+        results = executor.map(progress.track("spaces", delete_space), spaces)
 
     deleted_all_spaces = all(results)
 
@@ -445,13 +955,30 @@ def delete_spaces(config: object) -> bool:
     return deleted_all_spaces
 
 
-def delete_apps(config: object) -> bool:
-    """Deletes all running Apps in the domain"""
+def delete_apps(
+    config: object,
+    apps: list = None,
+    progress: Progress = None,
+    rate_limiter: RateLimiter = None,
+) -> bool:
+    """Deletes running Apps in the domain
+
+    Parameters:
+        config (object): CLI configuration object.
+        apps (list): (optional) App summaries to delete. Defaults to all apps in the domain
+        progress (Progress): (optional) Tracks progress under 'apps'
+        rate_limiter (RateLimiter): (optional) Paces the DeleteApp requests
+
+    Returns:
+        bool: True if all apps were deleted
+    """
     click.echo(
         "\n** Stopping all running apps (Notebooks/Code Editors) in the domain... **"
     )
 
-    sm_client = boto3.client("sagemaker", config.region)
+    sm_client = get_client("sagemaker", config.region)
+    progress = progress or Progress()
+    rate_limiter = rate_limiter or RateLimiter(0)
 
     def delete_app(app, time_to_wait=2):
         app_name = app["AppName"]
@@ -473,6 +1000,7 @@ def delete_apps(config: object) -> bool:
                 )
 
                 # Delete or update in progress
+                progress.retry("apps")
                 time.sleep(time_to_wait)
                 return delete_app(app, time_to_wait * 1.5)
 
@@ -488,6 +1016,7 @@ def delete_apps(config: object) -> bool:
 
             try:
                 # Status is InService - Delete app
+                rate_limiter.acquire()
                 sm_client.delete_app(
                     DomainId=config.domain_id,
                     AppName=app_name,
@@ -509,6 +1038,7 @@ def delete_apps(config: object) -> bool:
 
                     return False
 
+                progress.retry("apps")
                 time.sleep(time_to_wait)
 
                 return delete_app(app, time_to_wait * 1.5)
@@ -525,6 +1055,7 @@ def delete_apps(config: object) -> bool:
                         "There's some throttling exceptions... Calming down a bit.",
                         fg="yellow",
                     )
+                    progress.throttle("apps")
                     time.sleep(5)
                     return delete_app(app)
                 else:
@@ -535,24 +1066,16 @@ def delete_apps(config: object) -> bool:
             # App does not exist
             return True
 
-    apps = []
-    next_token = None
-
-    while True:
-        params = {"DomainIdEquals": config.domain_id}
-        if next_token:
-            params["NextToken"] = next_token
-
-        response = sm_client.list_apps(**params)
-        apps.extend(response["Apps"])
+    if apps is None:
+        apps = list_domain_resources(
+            sm_client, "list_apps", "Apps", config.domain_id
+        )
 
-        next_token = response.get("NextToken")
-        if not next_token:
-            break
+    progress.add("apps", len(apps))
 
     # Parallelize the app deletion
     with ThreadPoolExecutor(max_workers=5) as executor:
-        results = executor.map(delete_app, apps)
+        results = executor.map(progress.track("apps", delete_app), apps)
 
     deleted_all_apps = all(results)
 
@@ -567,6 +1090,37 @@ def delete_apps(config: object) -> bool:
     return deleted_all_apps
 
 
+def enable_ttl(ddb_client, table: str) -> None:
+    """Enables TTL on the TTL_ATTRIBUTE of a table, unless it already is
+
+    A table only has one TTL attribute. If it's another one, users are left
+    in the table after their retention and a warning is shown.
+    """
+
+    try:
+        response = ddb_client.describe_time_to_live(TableName=table)
+        description = response["TimeToLiveDescription"]
+        if description["TimeToLiveStatus"] in ["ENABLED", "ENABLING"]:
+            attribute = description.get("AttributeName")
+            if attribute != TTL_ATTRIBUTE:
+                click.secho(
+                    f"TTL on table {table} is set on {attribute} instead of {TTL_ATTRIBUTE}. "
+                    "Users won't be deleted once their retention has passed",
+                    fg="yellow",
+                )
+            return
+
+        ddb_client.update_time_to_live(
+            TableName=table,
+            TimeToLiveSpecification={"Enabled": True, "AttributeName": TTL_ATTRIBUTE},
+        )
+        click.echo(f"Enabled TTL on {TTL_ATTRIBUTE} for table: {table}")
+
+    except botocore.exceptions.ClientError as e:
+        # Users still expire in the web app at the end of their access window
+        click.secho(f"Could not enable TTL on table {table}:\n {e}", fg="yellow")
+
+
 def get_or_create_table(region: str) -> str:
     """Gets or creates a DDB table for keeping state
 
@@ -577,7 +1131,7 @@ def get_or_create_table(region: str) -> str:
         str: Name of DDB table
     """
 
-    ddb_client = boto3.client("dynamodb", region)
+    ddb_client = get_client("dynamodb", region)
 
     try:
         response = ddb_client.list_tables()
@@ -604,53 +1158,545 @@ def get_or_create_table(region: str) -> str:
             )
             click.echo(f"Created Table: {table}")
 
+            # TTL can only be enabled once the table is active
+            ddb_client.get_waiter("table_exists").wait(TableName=table)
+
+        enable_ttl(ddb_client, table)
+
         return table
 
     except Exception as e:
         click.echo(e)
 
 
-def get_users_from_ddb(config: object) -> object:
-    """Gets all users from DDB"""
-    dynamodb_resource = boto3.resource("dynamodb", config.region)
+def is_domain_item(config: object, item: dict) -> bool:
+    """Checks whether a DDB item belongs to the configured domain
+
+    Several domains in the same region share one table.
+    Items without a domain, like leases of older sharded runs, belong to all of them.
+    """
+
+    return item.get("domain-id", config.domain_id) == config.domain_id
+
+
+def get_user_items_from_ddb(config: object) -> dict:
+    """Gets the DDB items of all users in the configured domain
+
+    Parameters:
+        config (object): CLI configuration object.
+
+    Returns:
+        dict: {'email': item}
+    """
+    dynamodb_resource = get_resource("dynamodb", config.region)
     table = dynamodb_resource.Table(config.table_name)
 
     # Perform a scan operation to get all items in the table
     response = table.scan()
 
-    users = {}
+    items = {}
+
+    def is_user_item(item):
+        return not item["pk"].startswith(INTERNAL_KEY_PREFIX) and is_domain_item(
+            config, item
+        )
 
-    # Delete all items
     for item in response.get("Items", []):
-        users[item["pk"]] = item["team"]
+        if is_user_item(item):
+            items[item["pk"]] = item
 
         # Continue scanning if there are more items
     while "LastEvaluatedKey" in response:
         response = table.scan(ExclusiveStartKey=response["LastEvaluatedKey"])
         for item in response.get("Items", []):
-            users[item["pk"]] = item["team"]
+            if is_user_item(item):
+                items[item["pk"]] = item
 
-    return users
+    return items
+
+
+def get_users_from_ddb(config: object) -> object:
+    """Gets all users from DDB"""
+
+    items = get_user_items_from_ddb(config)
+
+    return {user_email: item["team"] for user_email, item in items.items()}
+
+
+def get_space_mode(user_items: dict) -> str:
+    """Gets the space mode the users in DDB were set up with
+
+    Parameters:
+        user_items (dict): {'email': item} as returned by get_user_items_from_ddb
+
+    Returns:
+        str: One of SPACE_MODES
+    """
 
+    if any(item.get("space-mode") == "team" for item in user_items.values()):
+        return "team"
 
-def clear_ddb(config: object) -> None:
-    """Deletes all items in the configured DDB table"""
+    return "user"
 
-    dynamodb_resource = boto3.resource("dynamodb", config.region)
+
+def clear_ddb(config: object, users_only: bool = False, run_id: str = None) -> None:
+    """Deletes all items of the configured domain in the configured DDB table
+
+    Leases of sharded runs are only deleted for run_id. Runs of other organisers
+    may still be in progress, even in another domain sharing the table.
+
+    Parameters:
+        config (object): CLI configuration object.
+        users_only (bool): Keep internal items, like the leases of a sharded run
+        run_id (str): (optional) Sharded run whose leases are deleted too
+
+    Returns:
+        None
+    """
+
+    dynamodb_resource = get_resource("dynamodb", config.region)
     table = dynamodb_resource.Table(config.table_name)
 
     click.echo("\n**Clearing DDB table... **")
 
+    def should_delete(item):
+        if item["pk"].startswith(INTERNAL_KEY_PREFIX):
+            if users_only:
+                return False
+            if "run_id" in item and item["run_id"] != run_id:
+                # Expire on their own, see LEASE_RETENTION_SECONDS in studio.utils.shards
+                return False
+        return is_domain_item(config, item)
+
     # Perform a scan operation to get all items in the table
     response = table.scan()
 
     # Delete all items
     with table.batch_writer() as batch:
         for item in response.get("Items", []):
-            batch.delete_item(Key={"pk": item["pk"]})
+            if should_delete(item):
+                batch.delete_item(Key={"pk": item["pk"]})
 
         # Continue scanning if there are more items
         while "LastEvaluatedKey" in response:
             response = table.scan(ExclusiveStartKey=response["LastEvaluatedKey"])
             for item in response.get("Items", []):
-                batch.delete_item(Key={"pk": item["pk"]})
+                if should_delete(item):
+                    batch.delete_item(Key={"pk": item["pk"]})
+
+
+def list_domain_resources(sm_client, operation: str, key: str, domain_id: str) -> list:
+    """Lists all resources of one kind in a domain, following pagination
+
+    Parameters:
+        sm_client: SageMaker boto3 client
+        operation (str): Name of the list operation, i.e 'list_apps'
+        key (str): Key holding the resources in the response, i.e 'Apps'
+        domain_id (str): SageMaker Studio Domain ID
+
+    Returns:
+        list: All resources returned by the list operation
+    """
+
+    resources = []
+    next_token = None
+
+    while True:
+        params = {"DomainIdEquals": domain_id, "MaxResults": 100}
+        if next_token:
+            params["NextToken"] = next_token
+
+        response = getattr(sm_client, operation)(**params)
+        resources.extend(response[key])
+
+        next_token = response.get("NextToken")
+        if not next_token:
+            break
+
+    return resources
+
+
+def list_tagged_resources(config: object) -> dict:
+    """Finds the configured event's user profiles, spaces and apps through their tags
+
+    A few paginated calls to the tagging API, however many other resources
+    share the domain. The tagging API doesn't return statuses, so the
+    summaries only hold what's needed to describe or delete each resource.
+    It's eventually consistent, and can miss resources created in the last
+    TAGGING_LAG.
+
+    Parameters:
+        config (object): CLI configuration object, with an event ID
+
+    Returns:
+        dict: {'user_profiles': [...], 'spaces': [...], 'apps': [...]}
+    """
+
+    tagging_client = get_client("resourcegroupstaggingapi", config.region)
+
+    resources = {"user_profiles": [], "spaces": [], "apps": []}
+    params = {
+        "TagFilters": [{"Key": EVENT_TAG_KEY, "Values": [config.event_id]}],
+        "ResourceTypeFilters": [
+            "sagemaker:user-profile",
+            "sagemaker:space",
+            "sagemaker:app",
+        ],
+        "ResourcesPerPage": 100,
+    }
+
+    while True:
+        response = tagging_client.get_resources(**params)
+
+        for mapping in response["ResourceTagMappingList"]:
+            # arn:aws:sagemaker:<region>:<account>:<type>/<domain id>/<path>
+            arn_resource = mapping["ResourceARN"].split(":", 5)[5]
+            resource_type, domain_id, *path = arn_resource.split("/")
+            if domain_id != config.domain_id:
+                # Same event in another domain
+                continue
+
+            tags = {tag["Key"]: tag["Value"] for tag in mapping.get("Tags", [])}
+            # Names are lowercased in ARNs. The tag holds the real one
+            name = tags.get(RESOURCE_NAME_TAG_KEY, path[0])
+
+            if resource_type == "user-profile":
+                resources["user_profiles"].append(
+                    {"DomainId": domain_id, "UserProfileName": name}
+                )
+            elif resource_type == "space":
+                resources["spaces"].append({"DomainId": domain_id, "SpaceName": name})
+            elif resource_type == "app" and len(path) == 3:
+                # Apps inherit the name tag of their space
+                resources["apps"].append(
+                    {
+                        "DomainId": domain_id,
+                        "SpaceName": name,
+                        "AppType": APP_TYPES.get(path[1], path[1]),
+                        "AppName": path[2],
+                    }
+                )
+
+        if not response.get("PaginationToken"):
+            break
+        params["PaginationToken"] = response["PaginationToken"]
+
+    return resources
+
+
+def get_roster_resource_names(config: object) -> dict:
+    """Gets the names of the user profiles and spaces of the configured event's users in DDB
+
+    Parameters:
+        config (object): CLI configuration object, with an event ID
+
+    Returns:
+        dict: {'user_profiles': set of names, 'spaces': set of names}
+    """
+
+    names = {"user_profiles": set(), "spaces": set()}
+    for user_email, item in get_user_items_from_ddb(config).items():
+        if item.get("event-id") != config.event_id:
+            continue
+
+        names["user_profiles"].add(get_username_from_email(user_email))
+        names["spaces"].update(
+            get_user_space_names(user_email, item["team"], item.get("space-mode", "user"))
+        )
+
+    return names
+
+
+def list_event_resources(config: object) -> dict:
+    """Finds the configured event's user profiles, spaces and apps
+
+    Goes through the tagging API, see list_tagged_resources. Resources created
+    in the last TAGGING_LAG may not have reached it yet. They're listed newest
+    first, stopping at the first older one, and kept if they're named after
+    one of the event's users in DDB.
+
+    Parameters:
+        config (object): CLI configuration object, with an event ID
+
+    Returns:
+        dict: {'user_profiles': [...], 'spaces': [...], 'apps': [...]}
+    """
+
+    sm_client = get_client("sagemaker", config.region)
+    since = datetime.now(timezone.utc) - TAGGING_LAG
+
+    listings = {
+        "user_profiles": ("list_user_profiles", "UserProfiles"),
+        "spaces": ("list_spaces", "Spaces"),
+        "apps": ("list_apps", "Apps"),
+    }
+
+    with ThreadPoolExecutor(max_workers=len(listings) + 1) as executor:
+        tagged_future = executor.submit(list_tagged_resources, config)
+        futures = {
+            name: executor.submit(
+                list_recent_resources,
+                sm_client,
+                operation,
+                key,
+                config.domain_id,
+                since,
+                "CreationTime",
+            )
+            for name, (operation, key) in listings.items()
+        }
+
+    resources = tagged_future.result()
+    recent = {name: future.result() for name, future in futures.items()}
+
+    def get_app_key(app):
+        return app.get("SpaceName"), app["AppType"], app["AppName"]
+
+    names = {
+        "user_profiles": {p["UserProfileName"] for p in resources["user_profiles"]},
+        "spaces": {s["SpaceName"] for s in resources["spaces"]},
+    }
+    untagged = {
+        "user_profiles": [
+            p for p in recent["user_profiles"] if p["UserProfileName"] not in names["user_profiles"]
+        ],
+        "spaces": [s for s in recent["spaces"] if s["SpaceName"] not in names["spaces"]],
+    }
+
+    if any(untagged.values()):
+        roster = get_roster_resource_names(config)
+        for profile in untagged["user_profiles"]:
+            if profile["UserProfileName"] in roster["user_profiles"]:
+                resources["user_profiles"].append(profile)
+                names["user_profiles"].add(profile["UserProfileName"])
+        for space in untagged["spaces"]:
+            if space["SpaceName"] in roster["spaces"]:
+                resources["spaces"].append(space)
+                names["spaces"].add(space["SpaceName"])
+
+    # Apps in the event's spaces, whether or not their tags are in yet
+    tagged_apps = {get_app_key(app) for app in resources["apps"]}
+    resources["apps"].extend(
+        app
+        for app in recent["apps"]
+        if app.get("SpaceName") in names["spaces"]
+        and get_app_key(app) not in tagged_apps
+    )
+
+    return resources
+
+
+def list_recent_resources(
+    sm_client,
+    operation: str,
+    key: str,
+    domain_id: str,
+    since: object,
+    sort_by: str = "LastModifiedTime",
+) -> list:
+    """Lists the resources of one kind modified, or created, since a point in time
+
+    Resources are listed newest first, and listing stops at the first one
+    older than since.
+
+    Parameters:
+        sm_client: SageMaker boto3 client
+        operation (str): Name of the list operation, i.e 'list_spaces'
+        key (str): Key holding the resources in the response, i.e 'Spaces'
+        domain_id (str): SageMaker Studio Domain ID
+        since (datetime): Resources older than this are left out
+        sort_by (str): 'LastModifiedTime' or 'CreationTime'. Apps can only be listed by CreationTime
+
+    Returns:
+        list: Resources modified or created since then
+    """
+
+    resources = []
+    params = {
+        "DomainIdEquals": domain_id,
+        "MaxResults": 100,
+        "SortBy": sort_by,
+        "SortOrder": "Descending",
+    }
+
+    while True:
+        response = getattr(sm_client, operation)(**params)
+
+        for resource in response[key]:
+            if resource[sort_by] < since:
+                return resources
+            resources.append(resource)
+
+        if not response.get("NextToken"):
+            return resources
+        params["NextToken"] = response["NextToken"]
+
+
+def refresh_resources(
+    sm_client, operation: str, key: str, name_key: str, domain_id: str, previous: list
+) -> list:
+    """Brings a listing from an earlier snapshot up to date
+
+    Only resources modified since the newest one in the earlier listing are
+    listed. Resources that were Deleting can't be seen disappearing that way,
+    so the listing is done in full while there are any.
+
+    Parameters:
+        sm_client: SageMaker boto3 client
+        operation (str): Name of the list operation, i.e 'list_spaces'
+        key (str): Key holding the resources in the response, i.e 'Spaces'
+        name_key (str): Key holding the name of each resource, i.e 'SpaceName'
+        domain_id (str): SageMaker Studio Domain ID
+        previous (list): Resources in the earlier snapshot
+
+    Returns:
+        list: All resources of the kind in the domain
+    """
+
+    if not previous or any(r["Status"] == "Deleting" for r in previous):
+        return list_domain_resources(sm_client, operation, key, domain_id)
+
+    # Listings are eventually consistent. Go back a bit to catch late arrivals
+    since = max(r["LastModifiedTime"] for r in previous) - SNAPSHOT_OVERLAP
+
+    resources = {r[name_key]: r for r in previous}
+    for resource in list_recent_resources(
+        sm_client, operation, key, domain_id, since
+    ):
+        resources[resource[name_key]] = resource
+
+    return list(resources.values())
+
+
+def get_domain_snapshot(config: object, previous: dict = None) -> dict:
+    """Lists user profiles, spaces and apps in the domain concurrently
+
+    With an event ID configured, only the event's resources are kept.
+
+    Given an earlier snapshot, only user profiles and spaces modified since
+    then are listed, and merged into it. Apps have no modification time and
+    are always listed in full. A full listing is done every FULL_SNAPSHOT_SECONDS
+    to drop resources that were deleted between two snapshots.
+
+    Parameters:
+        config (object): CLI configuration object.
+        previous (dict): (optional) Earlier snapshot of the same domain, to refresh
+
+    Returns:
+        dict: {'user_profiles': [...], 'spaces': [...], 'apps': [...], 'listed_at': epoch of the last full listing}
+    """
+
+    sm_client = get_client("sagemaker", config.region)
+
+    listings = {
+        "user_profiles": ("list_user_profiles", "UserProfiles", "UserProfileName"),
+        "spaces": ("list_spaces", "Spaces", "SpaceName"),
+    }
+
+    listed_at = time.time()
+    if previous and listed_at - previous["listed_at"] < FULL_SNAPSHOT_SECONDS:
+        listed_at = previous["listed_at"]
+    else:
+        previous = None
+
+    with ThreadPoolExecutor(max_workers=len(listings) + 1) as executor:
+        futures = {
+            name: executor.submit(
+                refresh_resources,
+                sm_client,
+                operation,
+                key,
+                name_key,
+                config.domain_id,
+                previous[name] if previous else None,
+            )
+            for name, (operation, key, name_key) in listings.items()
+        }
+        futures["apps"] = executor.submit(
+            list_domain_resources, sm_client, "list_apps", "Apps", config.domain_id
+        )
+
+    snapshot = {name: future.result() for name, future in futures.items()}
+    snapshot["listed_at"] = listed_at
+
+    if not config.event_id:
+        return snapshot
+
+    # Statuses come from the listings, which resources are ours from the tags
+    event_names = classify_event_resources(config, snapshot)
+    profile_names = event_names["user_profiles"]
+    space_names = event_names["spaces"]
+
+    return {
+        "user_profiles": [
+            p for p in snapshot["user_profiles"] if p["UserProfileName"] in profile_names
+        ],
+        "spaces": [s for s in snapshot["spaces"] if s["SpaceName"] in space_names],
+        "apps": [a for a in snapshot["apps"] if a.get("SpaceName") in space_names],
+        "listed_at": listed_at,
+    }
+
+
+def classify_event_resources(config: object, snapshot: dict) -> dict:
+    """Finds which user profiles and spaces in a domain snapshot belong to the configured event
+
+    Resources are classified once per process. The tagging API is only called
+    while the snapshot holds resources that haven't been classified yet. Recent
+    resources it doesn't return may just not have reached it, and are matched
+    against the event's users in DDB instead.
+
+    Parameters:
+        config (object): CLI configuration object, with an event ID
+        snapshot (dict): Unfiltered snapshot from get_domain_snapshot
+
+    Returns:
+        dict: {'user_profiles': set of names, 'spaces': set of names}
+    """
+
+    name_keys = {"user_profiles": "UserProfileName", "spaces": "SpaceName"}
+
+    with event_resource_names_lock:
+        known = event_resource_names.setdefault(
+            (config.domain_id, config.event_id), {kind: {} for kind in name_keys}
+        )
+        # Forget deleted resources, so the cache doesn't grow across events
+        for kind, name_key in name_keys.items():
+            listed = {r[name_key] for r in snapshot[kind]}
+            for name in set(known[kind]) - listed:
+                del known[kind][name]
+        unknown = {
+            kind: [r for r in snapshot[kind] if r[name_key] not in known[kind]]
+            for kind, name_key in name_keys.items()
+        }
+
+    if any(unknown.values()):
+        tagged_resources = list_tagged_resources(config)
+        tagged = {
+            kind: {r[name_key] for r in tagged_resources[kind]}
+            for kind, name_key in name_keys.items()
+        }
+
+        classified = {kind: {} for kind in name_keys}
+        roster = None
+        cutoff = datetime.now(timezone.utc) - TAGGING_LAG
+        for kind, name_key in name_keys.items():
+            for resource in unknown[kind]:
+                name = resource[name_key]
+                if name in tagged[kind]:
+                    classified[kind][name] = True
+                elif resource["CreationTime"] > cutoff:
+                    # One scan of DDB, only while there are recent resources without tags
+                    roster = roster or get_roster_resource_names(config)
+                    classified[kind][name] = name in roster[kind]
+                else:
+                    classified[kind][name] = False
+
+        with event_resource_names_lock:
+            for kind in name_keys:
+                known[kind].update(classified[kind])
+
+    with event_resource_names_lock:
+        return {
+            kind: {name for name, is_event_resource in known[kind].items() if is_event_resource}
+            for kind in name_keys
+        }
@@ -9,6 +9,21 @@ import click
 
 STUDIO_CLI_CONFIG_PATH = "~/.studio_cli/config"
 
+# Where presigned URLs land: the Studio home page or one of the user's spaces
+LANDING_CHOICES = ["home", "jupyter", "code-editor"]
+
+# Whether each user gets private Jupyter and Code Editor spaces, or each team shares one space
+SPACE_MODES = ["user", "team"]
+
+# Name of the profile stored at the top level of the configuration file
+DEFAULT_PROFILE = "default"
+
+# How users are split over several domains
+ASSIGNMENT_STRATEGIES = ["team", "capacity"]
+
+# Accepted formats for the start and end of the access window, in local time
+DATETIME_FORMATS = ["%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%Y-%m-%d"]
+
 
 def store_configuration(config) -> None:
     """Stores studio cli configuration
@@ -47,9 +62,126 @@ def get_configuration() -> object:
         return None
 
 
+def get_profiles(conf: object) -> dict:
+    """Gets all named profiles in a configuration
+
+    The default profile is stored at the top level of the configuration file,
+    other profiles under 'profiles'.
+
+    Parameters:
+        conf (object): Configuration data, as returned by get_configuration
+
+    Returns:
+        dict: {'profile name': {'region': ..., 'domain_id': ..., 'table_name': ...}}
+    """
+
+    if not conf:
+        return {}
+
+    profiles = {}
+
+    default = {key: value for key, value in conf.items() if key != "profiles"}
+    if default:
+        profiles[DEFAULT_PROFILE] = default
+
+    profiles.update(conf.get("profiles", {}))
+
+    return profiles
+
+
+def store_profile(name: str, profile: dict) -> None:
+    """Stores one profile, merged into the existing configuration file
+
+    Settings of the profile that aren't passed, other profiles and any other
+    keys in the configuration file are kept.
+
+    Parameters:
+        name (str): Profile name
+        profile (dict): Profile settings
+
+    Returns:
+        None
+    """
+
+    conf = get_configuration() or {}
+
+    if name == DEFAULT_PROFILE:
+        conf.update(profile)
+    else:
+        conf.setdefault("profiles", {}).setdefault(name, {}).update(profile)
+
+    if not conf.get("profiles"):
+        conf.pop("profiles", None)
+
+    store_configuration(conf)
+
+
+def get_state_tables(profiles: dict) -> list:
+    """Gets the tables holding the users of all profiles
+
+    Parameters:
+        profiles (dict): {'profile name': profile settings}
+
+    Returns:
+        list: 'region/table name' for each table, in profile order
+    """
+
+    tables = [
+        f"{profile['region']}/{profile['table_name']}"
+        for profile in profiles.values()
+        if profile.get("region") and profile.get("table_name")
+    ]
+
+    return list(dict.fromkeys(tables))
+
+
+def assign_users_to_profiles(users: dict, profiles: dict, strategy: str) -> dict:
+    """Splits users over several domains, keeping teams together
+
+    Parameters:
+        users (dict): {'email':'team'}
+        profiles (dict): {'profile name': profile settings}, in the order to fill them
+        strategy (str): 'team' spreads teams evenly over the domains. 'capacity'
+            fills the domains in order, up to the 'capacity' (number of users) of each profile
+
+    Returns:
+        dict: {'profile name': {'email':'team'}}
+    """
+
+    teams = {}
+    for user_email, team in users.items():
+        teams.setdefault(team, {})[user_email] = team
+
+    assignments = {name: {} for name in profiles}
+
+    # Biggest teams first, so they're spread out before the small ones fill the gaps
+    for team in sorted(teams, key=lambda t: (-len(teams[t]), t)):
+        members = teams[team]
+
+        if strategy == "capacity":
+            candidates = [
+                name
+                for name, profile in profiles.items()
+                if "capacity" not in profile
+                or len(assignments[name]) + len(members) <= int(profile["capacity"])
+            ]
+            if not candidates:
+                raise click.ClickException(
+                    f"There's not enough capacity in the profiles for team {team}"
+                )
+            name = candidates[0]
+        else:
+            name = min(assignments, key=lambda n: len(assignments[n]))
+
+        assignments[name].update(members)
+
+    return assignments
+
+
 # Define a simple configuration check function
-def is_configured() -> bool:
-    conf = get_configuration()
+def is_configured(conf: object = None) -> bool:
+    if conf is None:
+        conf = get_configuration()
     if conf:
         return True
     return False
@@ -61,7 +193,9 @@ def require_cli_config(func):
 
     @wraps(func)
     def wrapper(*args, **kwargs):
-        if is_configured():
+        # Reuse the configuration already loaded by the Config object, if passed
+        conf = getattr(args[0], "conf", None) if args else None
+        if is_configured(conf):
             # User is authenticated, call the original function
             return func(*args, **kwargs)
         else:
@@ -0,0 +1,323 @@
+import itertools
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import threading
+import time
+
+import click
+
+from studio.utils.cli import STUDIO_CLI_CONFIG_PATH
+
+# Lower numbers are served first. Organisers waiting on a command jump ahead of
+# background work like refreshing the cached domain state.
+INTERACTIVE = 0
+BACKGROUND = 10
+
+COMMAND_PRIORITIES = {
+    "ping": INTERACTIVE,
+    "get-urls": INTERACTIVE,
+    "status": INTERACTIVE,
+    "refresh": BACKGROUND,
+}
+
+# Seconds a client waits for the daemon before running the command without it.
+# Presigning URLs for every user takes a while, so clients ping a busy daemon first.
+COMMAND_TIMEOUTS = {
+    "ping": 5,
+    "get-urls": 300,
+    "status": 60,
+    "refresh": 60,
+}
+
+# This module is imported by thin clients, so it must not import boto3.
+# The server side imports studio.utils.aws when the daemon starts.
+
+
+def get_socket_path(profile: str) -> str:
+    """Gets the path of the Unix socket the daemon of a profile listens on"""
+
+    config_dir = os.path.dirname(os.path.expanduser(STUDIO_CLI_CONFIG_PATH))
+
+    return os.path.join(config_dir, f"daemon-{profile}.sock")
+
+
+def request_daemon(
+    profile: str, command: str, args: dict = None, timeout: float = None
+) -> dict:
+    """Sends a command to the daemon of a profile
+
+    Parameters:
+        profile (str): Profile the daemon was started for
+        command (str): Key in COMMAND_PRIORITIES
+        args (dict): (optional) Arguments of the command
+        timeout (float): (optional) Seconds to wait for the result. Defaults to COMMAND_TIMEOUTS
+
+    Returns:
+        dict: Result of the command, or None if no daemon is running or it didn't answer in time
+    """
+
+    path = get_socket_path(profile)
+    if not os.path.exists(path):
+        return None
+
+    timeout = timeout or COMMAND_TIMEOUTS[command]
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+
+        try:
+            try:
+                sock.connect(path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a daemon that didn't shut down cleanly
+                return None
+
+            request = {"command": command, "args": args or {}}
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+
+            with sock.makefile("r", encoding="utf-8") as file:
+                line = file.readline()
+
+        except socket.timeout:
+            click.secho(
+                f"The daemon didn't answer {command} within {timeout}s. Running without it",
+                fg="yellow",
+                err=True,
+            )
+            return None
+
+    if not line:
+        raise click.ClickException("The daemon closed the connection")
+
+    response = json.loads(line)
+    if not response["ok"]:
+        raise click.ClickException(f"The daemon failed: {response['error']}")
+
+    return response["result"]
+
+
+class DomainCache(object):
+    """Keeps the latest domain snapshot and roster of one domain in memory"""
+
+    def __init__(self, config: object) -> None:
+        self.config = config
+        self.snapshot = None
+        self.user_items = None
+        self.updated = 0
+        self.lock = threading.Lock()
+
+    def refresh(self) -> None:
+        """Re-reads the domain state and swaps it in once complete
+
+        Only what changed since the cached snapshot is listed.
+        """
+        from studio.utils.aws import get_domain_snapshot, get_user_items_from_ddb
+
+        snapshot = get_domain_snapshot(self.config, self.snapshot)
+        user_items = get_user_items_from_ddb(self.config)
+
+        with self.lock:
+            self.snapshot = snapshot
+            self.user_items = user_items
+            self.updated = time.monotonic()
+
+    def get(self, max_age: float = None) -> tuple:
+        """Gets the cached state, refreshing it first if it's older than max_age
+
+        Returns:
+            tuple: (snapshot, user items, age in seconds)
+        """
+
+        with self.lock:
+            age = time.monotonic() - self.updated
+
+        if self.snapshot is None or (max_age is not None and age > max_age):
+            self.refresh()
+            age = 0
+
+        with self.lock:
+            return self.snapshot, self.user_items, age
+
+
+class Daemon(object):
+    """Serves CLI commands for one domain from warm clients and cached state
+
+    Requests go through a priority queue served by a fixed number of worker
+    threads, so interactive commands are served before queued background work.
+    """
+
+    def __init__(
+        self, config: object, refresh_interval: float = 10, workers: int = 4
+    ) -> None:
+        self.config = config
+        self.refresh_interval = refresh_interval
+        self.workers = workers
+        self.cache = DomainCache(config)
+        self.jobs = queue.PriorityQueue()
+        self.sequence = itertools.count()
+        self.stopped = threading.Event()
+        self.refresh_pending = threading.Event()
+
+        self.handlers = {
+            "ping": self.ping,
+            "get-urls": self.get_urls,
+            "status": self.status,
+            "refresh": self.refresh,
+        }
+
+    def submit(self, command: str, args: dict) -> dict:
+        """Queues a command and waits for its response"""
+
+        done = threading.Event()
+        job = {"command": command, "args": args, "done": done}
+
+        # The sequence number keeps jobs of the same priority in arrival order
+        self.jobs.put((COMMAND_PRIORITIES[command], next(self.sequence), job))
+        done.wait()
+
+        return job["response"]
+
+    def _work(self) -> None:
+        while True:
+            _, _, job = self.jobs.get()
+            if job is None:
+                break
+
+            try:
+                result = self.handlers[job["command"]](**job["args"])
+                job["response"] = {"ok": True, "result": result}
+            except Exception as e:
+                click.secho(f"{job['command']} failed: {e}", fg="red")
+                job["response"] = {"ok": False, "error": str(e)}
+
+            job["done"].set()
+
+    def _schedule_refreshes(self) -> None:
+        while not self.stopped.wait(self.refresh_interval):
+            # Don't pile up refreshes when the workers are busy
+            if not self.refresh_pending.is_set():
+                self.refresh_pending.set()
+                threading.Thread(
+                    target=self.submit, args=("refresh", {}), daemon=True
+                ).start()
+
+    def ping(self) -> dict:
+        _, _, age = self.cache.get()
+        return {
+            "profile": self.config.profile,
+            "domain_id": self.config.domain_id,
+            "snapshot_age": age,
+        }
+
+    def refresh(self) -> dict:
+        try:
+            self.cache.refresh()
+        finally:
+            self.refresh_pending.clear()
+        return {}
+
+    def get_urls(self, landing: str = None) -> dict:
+        from studio.utils.aws import get_presigned_urls, get_space_mode
+
+        snapshot, user_items, _ = self.cache.get()
+        users = {user_email: item["team"] for user_email, item in user_items.items()}
+
+        urls = get_presigned_urls(
+            self.config,
+            users,
+            landing,
+            space_mode=get_space_mode(user_items),
+            spaces=snapshot["spaces"],
+        )
+
+        return {"urls": urls}
+
+    def status(self, previous: dict = None, max_age: float = None) -> dict:
+        from studio.utils.aws import get_space_mode
+        from studio.utils.status import format_status, summarize_status
+
+        snapshot, user_items, age = self.cache.get(max_age)
+        users = {user_email: item["team"] for user_email, item in user_items.items()}
+
+        summary = summarize_status(snapshot, users, get_space_mode(user_items))
+
+        return {
+            "summary": summary,
+            "output": format_status(summary, previous),
+            "snapshot_age": age,
+        }
+
+    def serve(self) -> None:
+        """Listens on the profile's socket until interrupted"""
+
+        # Warm up the clients and the cache before accepting requests
+        self.cache.refresh()
+
+        path = get_socket_path(self.config.profile)
+        if os.path.exists(path):
+            if request_daemon(self.config.profile, "ping") is not None:
+                raise click.ClickException(
+                    f"A daemon is already running for profile '{self.config.profile}'"
+                )
+            os.remove(path)
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                line = self.rfile.readline()
+                if not line:
+                    return
+
+                try:
+                    request = json.loads(line)
+                    if request["command"] not in daemon.handlers:
+                        raise ValueError(f"Unknown command {request['command']}")
+                    response = daemon.submit(request["command"], request["args"])
+                except (ValueError, KeyError) as e:
+                    response = {"ok": False, "error": str(e)}
+
+                self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        threads = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(self.workers)
+        ]
+        threads.append(threading.Thread(target=self._schedule_refreshes, daemon=True))
+        for thread in threads:
+            thread.start()
+
+        # The socket hands out presigned URLs. Only the owner may ever connect to it
+        umask = os.umask(0o177)
+        try:
+            server = Server(path, Handler)
+        finally:
+            os.umask(umask)
+
+        # Clean up the socket when stopped by a service manager too
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+        click.secho(
+            f"Daemon for profile '{self.config.profile}' ({self.config.domain_id}) "
+            f"listening on {path}. Ctrl+C to stop",
+            fg="cyan",
+        )
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stopped.set()
+            server.server_close()
+            os.remove(path)
+
+            for _ in range(self.workers):
+                self.jobs.put((BACKGROUND + 1, next(self.sequence), None))
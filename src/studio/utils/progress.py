@@ -0,0 +1,255 @@
+import sys
+import threading
+import time
+
+from functools import wraps
+
+import click
+
+COUNTERS = ["completed", "in_flight", "waiting", "failed", "retries", "throttles"]
+
+
+class PausingStream(object):
+    """Wraps stdout or stderr, taking the progress line out of the way of other output
+
+    Lines printed while the progress is shown, i.e by the functions in
+    studio.utils.aws, clear the progress line first. It's drawn again on the
+    next refresh.
+    """
+
+    def __init__(self, progress: "Progress", stream) -> None:
+        self.progress = progress
+        self.stream = stream
+
+    def write(self, text):
+        with self.progress.output_lock:
+            if isinstance(text, str) and text:
+                self.progress.clear()
+            return self.stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class Progress(object):
+    """Thread-safe progress and ETA tracking for long-running commands
+
+    Counts completed, in-flight, waiting and failed work per resource type,
+    along with retries and throttles. Throughput is an exponentially weighted
+    moving average of the time between completions, which the ETA is based on.
+    It only changes when work completes, so it holds steady while SageMaker
+    takes seconds per resource.
+
+    Used as a context manager, a background thread renders the progress to
+    stderr until the block exits. Outside a with block it only keeps count.
+    """
+
+    def __init__(
+        self, label: str = "", refresh_interval: float = 0.5, smoothing: float = 0.2
+    ) -> None:
+        self.label = label
+        self.refresh_interval = refresh_interval
+        self.smoothing = smoothing
+        self.resources = {}
+        self.expected = {}
+        self.lock = threading.Lock()
+        self.interval = None
+        self.last_completion = None
+        self.stopped = threading.Event()
+        self.renderer = None
+        self.is_tty = sys.stderr.isatty()
+        self.last_printed = 0
+        self.output_lock = threading.RLock()
+        self.stdout = None
+        self.stderr = sys.stderr
+        self.drawn = False
+
+    def __enter__(self):
+        self.last_completion = time.monotonic()
+
+        if self.is_tty:
+            # Other output goes around the progress line instead of through it
+            self.stdout, self.stderr = sys.stdout, sys.stderr
+            sys.stdout = PausingStream(self, self.stdout)
+            sys.stderr = PausingStream(self, self.stderr)
+
+        self.renderer = threading.Thread(target=self._render_loop, daemon=True)
+        self.renderer.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.renderer.join()
+
+        if self.is_tty:
+            sys.stdout, sys.stderr = self.stdout, self.stderr
+
+        self._print(self.render(), final=True)
+
+    def _counts(self, resource: str) -> dict:
+        # Callers hold the lock
+        if resource not in self.resources:
+            self.resources[resource] = {counter: 0 for counter in COUNTERS}
+        return self.resources[resource]
+
+    def expect(self, resource: str, count: int) -> None:
+        """Registers work that is only added later, so it's part of the ETA from the start
+
+        The next calls to add for the resource take from the expected count.
+        """
+        with self.lock:
+            self._counts(resource)["waiting"] += count
+            self.expected[resource] = self.expected.get(resource, 0) + count
+
+    def add(self, resource: str, count: int = 1) -> None:
+        """Registers work waiting to be started"""
+        with self.lock:
+            expected = min(count, self.expected.get(resource, 0))
+            self.expected[resource] = self.expected.get(resource, 0) - expected
+            self._counts(resource)["waiting"] += count - expected
+
+    def start(self, resource: str) -> None:
+        """Moves one unit of work from waiting to in flight"""
+        with self.lock:
+            counts = self._counts(resource)
+            counts["waiting"] = max(0, counts["waiting"] - 1)
+            counts["in_flight"] += 1
+
+    def finish(self, resource: str, ok: bool = True) -> None:
+        """Marks one unit of in-flight work as completed or failed"""
+        with self.lock:
+            counts = self._counts(resource)
+            counts["in_flight"] = max(0, counts["in_flight"] - 1)
+            counts["completed" if ok else "failed"] += 1
+            self._record_completion()
+
+    def retry(self, resource: str) -> None:
+        with self.lock:
+            self._counts(resource)["retries"] += 1
+
+    def throttle(self, resource: str) -> None:
+        with self.lock:
+            self._counts(resource)["throttles"] += 1
+
+    def track(self, resource: str, func):
+        """Wraps a function so each call is counted as one unit of work
+
+        Calls returning False, or raising, are counted as failed.
+        """
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            self.start(resource)
+            ok = False
+            try:
+                result = func(*args, **kwargs)
+                ok = result is not False
+                return result
+            finally:
+                self.finish(resource, ok)
+
+        return wrapper
+
+    def totals(self) -> dict:
+        """Sums the counters over all resource types"""
+        with self.lock:
+            return {
+                counter: sum(counts[counter] for counts in self.resources.values())
+                for counter in COUNTERS
+            }
+
+    def _record_completion(self) -> None:
+        """Updates the moving average of the time between completions"""
+        # Callers hold the lock
+
+        now = time.monotonic()
+        if self.last_completion is not None:
+            interval = now - self.last_completion
+            if self.interval is None:
+                self.interval = interval
+            else:
+                self.interval = (
+                    self.smoothing * interval + (1 - self.smoothing) * self.interval
+                )
+
+        self.last_completion = now
+
+    def rate(self) -> float:
+        """Completions per second, or None until work has completed"""
+
+        with self.lock:
+            interval = self.interval
+
+        if not interval:
+            return None
+
+        return 1 / interval
+
+    def eta(self) -> float:
+        """Estimated seconds until all registered work is done, or None if unknown"""
+
+        totals = self.totals()
+        remaining = totals["waiting"] + totals["in_flight"]
+
+        if not remaining:
+            return 0
+
+        rate = self.rate()
+        if not rate:
+            return None
+
+        return remaining / rate
+
+    def render(self) -> str:
+        """Renders the progress as one line"""
+
+        with self.lock:
+            parts = []
+            for resource, counts in self.resources.items():
+                total = sum(counts[c] for c in ["completed", "in_flight", "waiting", "failed"])
+                part = (
+                    f"{resource} {counts['completed']}/{total} done, "
+                    f"{counts['in_flight']} in flight, {counts['waiting']} waiting"
+                )
+                for counter in ["failed", "retries", "throttles"]:
+                    if counts[counter]:
+                        part += f", {counts[counter]} {counter}"
+                parts.append(part)
+
+        if not parts:
+            line = "starting..."
+        else:
+            line = " | ".join(parts)
+
+            rate = self.rate()
+            eta = self.eta()
+            if rate is not None:
+                line += f" | {rate:.1f}/s"
+            if eta is not None:
+                line += f" ETA {int(eta) // 60}:{int(eta) % 60:02d}"
+
+        return f"{self.label}: {line}" if self.label else line
+
+    def clear(self) -> None:
+        """Removes the progress line from the terminal until the next refresh"""
+        with self.output_lock:
+            if self.drawn:
+                self.stderr.write("\r\033[K")
+                self.stderr.flush()
+                self.drawn = False
+
+    def _print(self, line: str, final: bool = False) -> None:
+        if self.is_tty:
+            # Redraw the same line, clearing whatever was there before
+            with self.output_lock:
+                self.stderr.write(f"\r\033[K{line}" + ("\n" if final else ""))
+                self.stderr.flush()
+                self.drawn = not final
+        elif final or time.monotonic() - self.last_printed >= 10:
+            # Don't flood logs when output isn't a terminal
+            click.echo(line, err=True)
+            self.last_printed = time.monotonic()
+
+    def _render_loop(self) -> None:
+        while not self.stopped.wait(self.refresh_interval):
+            self._print(self.render())
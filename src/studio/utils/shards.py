@@ -0,0 +1,556 @@
+import hashlib
+import multiprocessing
+import os
+import socket
+import threading
+import time
+
+import boto3
+import botocore
+import click
+
+from boto3.dynamodb.conditions import Attr
+
+from studio.utils.aws import (
+    INTERNAL_KEY_PREFIX,
+    TTL_ATTRIBUTE,
+    add_users_to_ddb,
+    clear_ddb,
+    create_sagemaker_spaces,
+    create_sagemaker_team_spaces,
+    create_sagemaker_user_profiles,
+    delete_apps,
+    delete_spaces,
+    delete_users,
+    get_username_from_email,
+    record_created_resources,
+)
+
+LEASE_KEY_PREFIX = f"{INTERNAL_KEY_PREFIX}lease#"
+RUN_KEY_PREFIX = f"{INTERNAL_KEY_PREFIX}run#"
+
+# How many times a failed shard is claimed again before it's left failed
+MAX_SHARD_ATTEMPTS = 3
+
+# clear_ddb leaves the leases of other runs alone. DynamoDB deletes them this long after their last claim
+LEASE_RETENTION_SECONDS = 7 * 24 * 60 * 60
+
+
+def get_shard(key: str, shard_count: int) -> int:
+    """Hashes a key to a shard
+
+    Parameters:
+        key (str): Key to hash, i.e a username
+        shard_count (int): Total number of shards
+
+    Returns:
+        int: Shard number between 0 and shard_count - 1
+    """
+
+    digest = hashlib.md5(key.encode("utf-8")).hexdigest()
+
+    return int(digest, 16) % shard_count
+
+
+def get_lease_key(run_id: str, shard: int) -> str:
+    """Gets the DDB key of the lease for one shard of a run"""
+
+    return f"{LEASE_KEY_PREFIX}{run_id}#{shard:05d}"
+
+
+def get_run_key(run_id: str) -> str:
+    """Gets the DDB key of the lease for the preparation of a run"""
+
+    return f"{RUN_KEY_PREFIX}{run_id}"
+
+
+def get_owner_keys(snapshot: dict) -> dict:
+    """Maps each space in a domain snapshot to the user profile owning it
+
+    Resources are sharded on their owner, so a users apps, spaces and user
+    profile always end up in the same shard and can be deleted in order.
+
+    Parameters:
+        snapshot (dict): Snapshot from get_domain_snapshot
+
+    Returns:
+        dict: {'space name': 'owner key'}
+    """
+
+    owners = {}
+    for space in snapshot["spaces"]:
+        owner = space.get("OwnershipSettingsSummary", {}).get("OwnerUserProfileName")
+        owners[space["SpaceName"]] = owner or space["SpaceName"]
+
+    return owners
+
+
+def setup_users_shard(config: object, shard: int, shard_count: int, setup: dict) -> tuple:
+    """Creates user profiles and spaces for the users in one shard
+
+    Parameters:
+        config (object): CLI configuration object.
+        shard (int): Shard to process
+        shard_count (int): Total number of shards
+        setup (dict): {'users': {'email':'team'} for all users, 'space_mode': one of SPACE_MODES,
+            'access_window': access window for add_users_to_ddb, or None}
+
+    Returns:
+        tuple: (True if the shard completed, number of users processed)
+    """
+
+    users = setup["users"]
+    space_mode = setup["space_mode"]
+
+    def get_key(user_email):
+        # A team's shared space is owned by one of its members, so teams stay together
+        if space_mode == "team":
+            return str(users[user_email])
+        return get_username_from_email(user_email)
+
+    shard_users = {
+        user_email: team
+        for user_email, team in users.items()
+        if get_shard(get_key(user_email), shard_count) == shard
+    }
+
+    if shard_users:
+        items = add_users_to_ddb(
+            config, shard_users, space_mode, setup.get("access_window")
+        )
+        failed_profiles = create_sagemaker_user_profiles(config, shard_users.keys())
+        if space_mode == "team":
+            failed_spaces = create_sagemaker_team_spaces(config, shard_users)
+        else:
+            failed_spaces = create_sagemaker_spaces(config, shard_users.keys())
+
+        # Users are marked ready once per run, after all shards, see setup-users
+        record_created_resources(config, items, failed_profiles, failed_spaces)
+
+    return True, len(shard_users)
+
+
+def purge_shard(config: object, shard: int, shard_count: int, snapshot: dict) -> tuple:
+    """Deletes apps, spaces and user profiles in one shard
+
+    Parameters:
+        config (object): CLI configuration object.
+        shard (int): Shard to process
+        shard_count (int): Total number of shards
+        snapshot (dict): Snapshot from get_domain_snapshot
+
+    Returns:
+        tuple: (True if everything in the shard was deleted, number of resources processed)
+    """
+
+    owners = get_owner_keys(snapshot)
+
+    def in_shard(key):
+        return get_shard(key, shard_count) == shard
+
+    apps = [
+        app
+        for app in snapshot["apps"]
+        if in_shard(owners.get(app.get("SpaceName"), app.get("SpaceName", "")))
+    ]
+    spaces = [s for s in snapshot["spaces"] if in_shard(owners[s["SpaceName"]])]
+    user_profiles = [
+        p for p in snapshot["user_profiles"] if in_shard(p["UserProfileName"])
+    ]
+
+    deleted_all = delete_apps(config, apps)
+
+    if deleted_all:
+        deleted_all = delete_spaces(config, spaces)
+
+    if deleted_all:
+        deleted_all = delete_users(config, user_profiles)
+
+    return deleted_all, len(apps) + len(spaces) + len(user_profiles)
+
+
+def clear_users(config: object) -> None:
+    """Clears the users of the domain, keeping the leases of all runs"""
+
+    clear_ddb(config, users_only=True)
+
+
+TASKS = {
+    "setup-users": setup_users_shard,
+    "purge": purge_shard,
+}
+
+# Done once per run, by whichever worker gets there first, before any shard is processed
+PREPARATIONS = {
+    "setup-users": clear_users,
+}
+
+
+def claim_lease(table, key: str, owner: str, lease_seconds: int, **attributes) -> bool:
+    """Claims a lease with a conditional write
+
+    A lease can be claimed if nobody has claimed it yet, if the worker holding
+    it stopped renewing it before finishing, or if it failed fewer than
+    MAX_SHARD_ATTEMPTS times. Leases expire LEASE_RETENTION_SECONDS after
+    their last claim.
+
+    Returns:
+        bool: True if the lease was claimed by owner
+    """
+
+    now = int(time.time())
+
+    names = {"#owner": "owner", "#status": "status", "#ttl": TTL_ATTRIBUTE}
+    values = {
+        ":owner": owner,
+        ":running": "running",
+        ":failed": "failed",
+        ":expires": now + lease_seconds,
+        ":now": now,
+        ":one": 1,
+        ":max_attempts": MAX_SHARD_ATTEMPTS,
+        ":ttl": now + LEASE_RETENTION_SECONDS,
+    }
+    updates = [
+        "#owner = :owner",
+        "#status = :running",
+        "lease_expires = :expires",
+        "updated_at = :now",
+        "#ttl = :ttl",
+    ]
+
+    for i, (name, value) in enumerate(attributes.items()):
+        names[f"#a{i}"] = name
+        values[f":a{i}"] = value
+        updates.append(f"#a{i} = :a{i}")
+
+    try:
+        table.update_item(
+            Key={"pk": key},
+            UpdateExpression="SET " + ", ".join(updates) + " ADD attempts :one",
+            ConditionExpression="attribute_not_exists(pk) "
+            "OR (#status = :running AND lease_expires < :now) "
+            "OR (#status = :failed AND (attribute_not_exists(attempts) OR attempts < :max_attempts))",
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+        )
+        return True
+
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            # Someone else holds or has finished it
+            return False
+        raise
+
+
+def claim_shard(
+    table,
+    run_id: str,
+    shard: int,
+    shard_count: int,
+    owner: str,
+    lease_seconds: int,
+    domain_id: str,
+) -> bool:
+    """Claims a shard of a run
+
+    Returns:
+        bool: True if the shard was claimed by owner
+    """
+
+    return claim_lease(
+        table,
+        get_lease_key(run_id, shard),
+        owner,
+        lease_seconds,
+        run_id=run_id,
+        shard=shard,
+        shard_count=shard_count,
+        **{"domain-id": domain_id},
+    )
+
+
+def update_lease(table, key: str, owner: str, **attributes) -> bool:
+    """Updates a lease held by owner
+
+    Returns:
+        bool: False if the lease has been taken over by someone else
+    """
+
+    names = {"#owner": "owner"}
+    values = {":owner": owner, ":now": int(time.time())}
+    updates = ["updated_at = :now"]
+
+    for i, (name, value) in enumerate(attributes.items()):
+        names[f"#a{i}"] = name
+        values[f":a{i}"] = value
+        updates.append(f"#a{i} = :a{i}")
+
+    try:
+        table.update_item(
+            Key={"pk": key},
+            UpdateExpression="SET " + ", ".join(updates),
+            ConditionExpression="#owner = :owner",
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+        )
+        return True
+
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+        raise
+
+
+def prepare_run(
+    config: object, task_name: str, run_id: str, owner: str, lease_seconds: int = 300
+) -> None:
+    """Runs the preparation of a task once per run, and waits for it on other workers
+
+    Parameters:
+        config (object): CLI configuration object.
+        task_name (str): Key in TASKS
+        run_id (str): ID shared by all workers taking part in the run
+        owner (str): ID of this worker
+        lease_seconds (int): How long the preparation is held before another worker takes over
+
+    Returns:
+        None
+    """
+
+    prepare = PREPARATIONS.get(task_name)
+    if prepare is None:
+        return
+
+    table = boto3.resource("dynamodb", config.region).Table(config.table_name)
+    key = get_run_key(run_id)
+
+    while True:
+        if claim_lease(
+            table,
+            key,
+            owner,
+            lease_seconds,
+            run_id=run_id,
+            **{"domain-id": config.domain_id},
+        ):
+            try:
+                prepare(config)
+            except Exception:
+                update_lease(table, key, owner, status="failed")
+                raise
+
+            update_lease(table, key, owner, status="done")
+            return
+
+        lease = table.get_item(Key={"pk": key}, ConsistentRead=True).get("Item", {})
+        if lease.get("status") == "done":
+            return
+
+        if lease.get("status") == "failed" and lease.get("attempts", 0) >= MAX_SHARD_ATTEMPTS:
+            raise click.ClickException(f"Preparing run {run_id} failed. Start a new run")
+
+        # Another worker is preparing the run
+        time.sleep(2)
+
+
+def run_shard_worker(
+    config: object,
+    task_name: str,
+    payload: object,
+    run_id: str,
+    shard_count: int,
+    worker_index: int = 0,
+    workers: int = 1,
+    lease_seconds: int = 300,
+) -> None:
+    """Claims and processes shards until there are none left to claim
+
+    Parameters:
+        config (object): CLI configuration object.
+        task_name (str): Key in TASKS
+        payload (object): Passed on to the task, i.e the users or a domain snapshot
+        run_id (str): ID shared by all workers, on all hosts, taking part in the run
+        shard_count (int): Total number of shards
+        worker_index (int): Index of this worker on this host. Spreads out where workers start claiming
+        workers (int): Number of workers on this host
+        lease_seconds (int): How long a claimed shard is held without renewal
+
+    Returns:
+        None
+    """
+
+    task = TASKS[task_name]
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    table = boto3.resource("dynamodb", config.region).Table(config.table_name)
+
+    prepare_run(config, task_name, run_id, owner, lease_seconds)
+
+    first_shard = worker_index * shard_count // workers
+    shards = list(range(first_shard, shard_count)) + list(range(first_shard))
+
+    for shard in shards:
+        if not claim_shard(
+            table, run_id, shard, shard_count, owner, lease_seconds, config.domain_id
+        ):
+            continue
+
+        key = get_lease_key(run_id, shard)
+        stop_renewing = threading.Event()
+
+        def renew_lease():
+            """Keeps the lease alive while the shard is being processed"""
+            while not stop_renewing.wait(lease_seconds / 3):
+                expires = int(time.time()) + lease_seconds
+                if not update_lease(table, key, owner, lease_expires=expires):
+                    break
+
+        renewer = threading.Thread(target=renew_lease, daemon=True)
+        renewer.start()
+
+        try:
+            completed, items = task(config, shard, shard_count, payload)
+        except Exception as e:
+            click.secho(f"Shard {shard} failed: {e}", fg="red")
+            completed, items = False, 0
+        finally:
+            stop_renewing.set()
+            renewer.join()
+
+        if not update_lease(
+            table,
+            key,
+            owner,
+            **{"status": "done" if completed else "failed", "items": items},
+        ):
+            click.secho(
+                f"Lost the lease on shard {shard} before finishing it", fg="yellow"
+            )
+
+
+def get_run_progress(config: object, run_id: str) -> dict:
+    """Reads the state of all shard leases of a run
+
+    Parameters:
+        config (object): CLI configuration object.
+        run_id (str): ID of the run
+
+    Returns:
+        dict: Number of shards per state, and items processed in finished shards
+    """
+
+    table = boto3.resource("dynamodb", config.region).Table(config.table_name)
+
+    params = {"FilterExpression": Attr("pk").begins_with(f"{LEASE_KEY_PREFIX}{run_id}#")}
+    leases = []
+
+    while True:
+        response = table.scan(**params)
+        leases.extend(response.get("Items", []))
+
+        if "LastEvaluatedKey" not in response:
+            break
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    now = int(time.time())
+    progress = {
+        "shards": 0,
+        "done": 0,
+        "failed": 0,
+        "running": 0,
+        "expired": 0,
+        "items": 0,
+    }
+
+    for lease in leases:
+        progress["shards"] = int(lease["shard_count"])
+
+        if lease["status"] == "running" and lease["lease_expires"] < now:
+            progress["expired"] += 1
+        else:
+            progress[lease["status"]] += 1
+
+        progress["items"] += int(lease.get("items", 0))
+
+    progress["unclaimed"] = progress["shards"] - len(leases)
+
+    return progress
+
+
+def format_run_progress(run_id: str, progress: dict) -> str:
+    """Renders run progress as one line"""
+
+    return (
+        f"Run {run_id}: {progress['done']}/{progress['shards']} shards done, "
+        f"{progress['running']} running, {progress['failed']} failed, "
+        f"{progress['expired']} with expired leases, {progress['unclaimed']} unclaimed "
+        f"({progress['items']} items processed)"
+    )
+
+
+def run_sharded(
+    config: object,
+    task_name: str,
+    payload: object,
+    run_id: str,
+    shard_count: int,
+    workers: int = 1,
+    lease_seconds: int = 300,
+) -> dict:
+    """Runs a task over all shards using worker processes on this host
+
+    Other hosts can take part in the same run by starting workers with the same
+    run_id. Each shard is processed by exactly one worker at a time.
+
+    Parameters:
+        config (object): CLI configuration object.
+        task_name (str): Key in TASKS
+        payload (object): Passed on to the task
+        run_id (str): ID shared by all workers taking part in the run
+        shard_count (int): Total number of shards
+        workers (int): Number of worker processes on this host
+        lease_seconds (int): How long a claimed shard is held without renewal
+
+    Returns:
+        dict: Progress of the run once this host has no more shards to claim
+    """
+
+    if workers == 1:
+        run_shard_worker(config, task_name, payload, run_id, shard_count)
+        return get_run_progress(config, run_id)
+
+    # Spawn fresh interpreters rather than forking, so boto3 clients are never shared
+    context = multiprocessing.get_context("spawn")
+
+    processes = [
+        context.Process(
+            target=run_shard_worker,
+            args=(
+                config,
+                task_name,
+                payload,
+                run_id,
+                shard_count,
+                worker_index,
+                workers,
+                lease_seconds,
+            ),
+        )
+        for worker_index in range(workers)
+    ]
+
+    for process in processes:
+        process.start()
+
+    while True:
+        alive = [process for process in processes if process.is_alive()]
+        if not alive:
+            break
+
+        alive[0].join(timeout=5)
+        click.secho(
+            format_run_progress(run_id, get_run_progress(config, run_id)), fg="cyan"
+        )
+
+    return get_run_progress(config, run_id)
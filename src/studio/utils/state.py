@@ -0,0 +1,220 @@
+import gzip
+import json
+import queue
+import random
+import threading
+import time
+
+import click
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from studio.utils.aws import get_client
+from studio.utils.throttle import RateLimiter
+
+# BatchWriteItem takes at most 25 items per request
+BATCH_SIZE = 25
+
+
+def open_state_file(path: str, mode: str):
+    """Opens a state file, gzip compressed if the path ends with .gz
+
+    Parameters:
+        path (str): Path to the state file
+        mode (str): 'r' or 'w'
+
+    Returns:
+        file: Text file object
+    """
+
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+
+    return open(path, mode, encoding="utf-8")
+
+
+def export_state(config: object, path: str, segments: int = 4) -> int:
+    """Exports all items in the DDB table to a newline delimited JSON file
+
+    The table is read with a parallel scan. Items are written in the DynamoDB
+    JSON format, so they can be imported without any type conversion.
+
+    Parameters:
+        config (object): CLI configuration object.
+        path (str): Path to the state file. Compressed with gzip if it ends with .gz
+        segments (int): Number of parallel scan segments
+
+    Returns:
+        int: Number of exported items
+    """
+
+    ddb_client = get_client("dynamodb", config.region)
+
+    pages = queue.Queue(maxsize=segments * 2)
+    done = object()
+    # Set when the writer stops, so scans don't block on a queue nobody reads
+    stopped = threading.Event()
+
+    def hand_over(page: object) -> bool:
+        """Puts a page on the queue, unless the writer has stopped"""
+
+        while not stopped.is_set():
+            try:
+                pages.put(page, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def scan_segment(segment: int) -> None:
+        """Scans one segment and hands each page over to the writer"""
+
+        params = {
+            "TableName": config.table_name,
+            "Segment": segment,
+            "TotalSegments": segments,
+        }
+
+        try:
+            while True:
+                response = ddb_client.scan(**params)
+                if not hand_over(response.get("Items", [])):
+                    break
+
+                if "LastEvaluatedKey" not in response:
+                    break
+                params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        finally:
+            hand_over(done)
+
+    count = 0
+
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        futures = [executor.submit(scan_segment, i) for i in range(segments)]
+
+        try:
+            with open_state_file(path, "w") as file:
+                finished = 0
+                while finished < segments:
+                    page = pages.get()
+                    if page is done:
+                        finished += 1
+                        continue
+
+                    for item in page:
+                        file.write(json.dumps(item, separators=(",", ":")) + "\n")
+                    count += len(page)
+        finally:
+            # Writing failed or was interrupted. Let the scans finish
+            stopped.set()
+
+    # Surface scan errors
+    for future in futures:
+        future.result()
+
+    return count
+
+
+def get_write_capacity(config: object) -> int:
+    """Gets the provisioned write capacity of the DDB table
+
+    Parameters:
+        config (object): CLI configuration object.
+
+    Returns:
+        int: Write capacity units per second, or 0 for on-demand tables
+    """
+
+    ddb_client = get_client("dynamodb", config.region)
+    table = ddb_client.describe_table(TableName=config.table_name)["Table"]
+
+    if table.get("BillingModeSummary", {}).get("BillingMode") == "PAY_PER_REQUEST":
+        return 0
+
+    return table.get("ProvisionedThroughput", {}).get("WriteCapacityUnits", 0)
+
+
+def import_state(
+    config: object, path: str, workers: int = 5, max_wcu: int = None
+) -> int:
+    """Imports items from a state file into the DDB table
+
+    Items are written with concurrent BatchWriteItem requests. Unprocessed
+    items are retried with exponential backoff, and writes are paced to the
+    table's provisioned write capacity, or max_wcu if given.
+
+    Parameters:
+        config (object): CLI configuration object.
+        path (str): Path to a state file created by export_state
+        workers (int): Number of concurrent batch writers
+        max_wcu (int): (optional) Write capacity units per second to stay under
+
+    Returns:
+        int: Number of imported items
+    """
+
+    ddb_client = get_client("dynamodb", config.region)
+
+    if max_wcu is None:
+        max_wcu = get_write_capacity(config)
+
+    # Assumes items below 1 KB, i.e one write capacity unit per item
+    rate_limiter = RateLimiter(max_wcu)
+
+    def write_batch(items: list) -> int:
+        """Writes one batch, retrying unprocessed items until all are written"""
+
+        requests = [{"PutRequest": {"Item": item}} for item in items]
+        attempt = 0
+
+        while requests:
+            rate_limiter.acquire(len(requests))
+
+            response = ddb_client.batch_write_item(
+                RequestItems={config.table_name: requests}
+            )
+            requests = response.get("UnprocessedItems", {}).get(config.table_name, [])
+
+            if requests:
+                # Table is throttling us. Back off before retrying the leftovers
+                attempt += 1
+                time.sleep(min(5, 0.05 * 2**attempt) * random.uniform(0.5, 1))
+
+        return len(items)
+
+    def read_batches():
+        """Yields batches of items from the state file"""
+
+        batch = []
+        with open_state_file(path, "r") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+
+                batch.append(json.loads(line))
+                if len(batch) == BATCH_SIZE:
+                    yield batch
+                    batch = []
+
+        if batch:
+            yield batch
+
+    count = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        for batch in read_batches():
+            # Keep a bounded number of batches in memory
+            if len(in_flight) >= workers * 2:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                count += sum(future.result() for future in finished)
+            in_flight.add(executor.submit(write_batch, batch))
+
+        for future in in_flight:
+            count += future.result()
+
+    if config.verbose:
+        click.echo(f"Wrote {count} items with at most {max_wcu or 'unlimited'} WCU/s")
+
+    return count
@@ -0,0 +1,293 @@
+import time
+
+import click
+
+from studio.utils.aws import (
+    get_client,
+    get_user_space_names,
+    get_username_from_email,
+    list_domain_resources,
+    update_user_items,
+)
+from studio.utils.progress import Progress
+
+FAILED_STATUSES = ["Failed", "Update_Failed", "Delete_Failed"]
+
+COLUMNS = [
+    ("users", "Users"),
+    ("provisioned", "Provisioned"),
+    ("pending", "Pending"),
+    ("missing", "Missing"),
+    ("failed", "Failed"),
+    ("apps_running", "Apps running"),
+    ("apps_pending", "Apps pending"),
+]
+
+
+def get_user_state(profile: object, spaces: list) -> str:
+    """Derives the provisioning state of one user
+
+    Parameters:
+        profile (object): User profile summary, or None if it doesn't exist
+        spaces (list): Space summaries for the user's spaces, None for missing spaces
+
+    Returns:
+        str: One of 'provisioned', 'pending', 'missing' or 'failed'
+    """
+
+    resources = [profile] + spaces
+
+    if any(r and r["Status"] in FAILED_STATUSES for r in resources):
+        return "failed"
+
+    if any(r is None for r in resources):
+        return "missing"
+
+    if all(r["Status"] == "InService" for r in resources):
+        return "provisioned"
+
+    return "pending"
+
+
+def wait_until_ready(
+    config: object,
+    items: dict,
+    progress: Progress = None,
+    timeout: int = 600,
+    interval: int = 10,
+) -> set:
+    """Marks users ready in DDB once SageMaker reports their profile and spaces InService
+
+    Users are stored as in-progress once their resources are created. Each poll
+    lists the user profiles and spaces of the domain once, and writes the users
+    that became ready, or failed, along with the status of their profile and
+    spaces, in one batch.
+
+    Parameters:
+        config (object): CLI configuration object.
+        items (dict): {'email': item} of the in-progress users, as returned by record_created_resources
+        progress (Progress): (optional) Tracks progress under 'ready'
+        timeout (int): Seconds to wait before leaving the remaining users in-progress
+        interval (int): Seconds between polls
+
+    Returns:
+        set: Emails of the users that aren't ready yet
+    """
+
+    sm_client = get_client("sagemaker", config.region)
+    progress = progress or Progress()
+
+    waiting = set(items)
+    progress.add("ready", len(waiting))
+    deadline = time.monotonic() + timeout
+
+    while waiting:
+        profiles = {
+            p["UserProfileName"]: p
+            for p in list_domain_resources(
+                sm_client, "list_user_profiles", "UserProfiles", config.domain_id
+            )
+        }
+        spaces = {
+            s["SpaceName"]: s
+            for s in list_domain_resources(
+                sm_client, "list_spaces", "Spaces", config.domain_id
+            )
+        }
+
+        updates = {}
+        for user_email in waiting:
+            item = items[user_email]
+            profile = profiles.get(get_username_from_email(user_email))
+            user_spaces = [
+                spaces.get(name)
+                for name in get_user_space_names(
+                    user_email, item["team"], item.get("space-mode", "user")
+                )
+            ]
+
+            # Missing resources were only just created. Keep waiting for them
+            state = get_user_state(profile, user_spaces)
+            if state not in ["provisioned", "failed"]:
+                continue
+
+            # The status of the space holding things up, if any
+            space_statuses = [space["Status"] if space else "missing" for space in user_spaces]
+            updates[user_email] = {
+                "provisioning-status": "ready" if state == "provisioned" else "failed",
+                "profile-status": profile["Status"] if profile else "missing",
+                "space-status": next(
+                    (status for status in space_statuses if status != "InService"),
+                    "InService",
+                ),
+            }
+
+        if updates:
+            update_user_items(config, items, updates)
+            for attributes in updates.values():
+                progress.start("ready")
+                progress.finish("ready", attributes["provisioning-status"] == "ready")
+            waiting -= set(updates)
+
+        if not waiting:
+            break
+
+        if time.monotonic() >= deadline:
+            click.secho(
+                f"{len(waiting)} users aren't InService after {timeout}s and stay in-progress. "
+                "Run setup-users again once 'studio status' shows them provisioned",
+                fg="yellow",
+            )
+            break
+
+        time.sleep(interval)
+
+    return waiting
+
+
+def summarize_status(snapshot: dict, users: dict, space_mode: str = "user") -> dict:
+    """Joins a domain snapshot with the roster and counts states per team
+
+    Parameters:
+        snapshot (dict): Snapshot from get_domain_snapshot
+        users (dict): {'email': 'team'} as returned by get_users_from_ddb
+        space_mode (str): One of SPACE_MODES. In team mode each user needs their team's space
+
+    Returns:
+        dict: {'teams': {team: counts}, 'total': counts, 'orphans': counts}
+    """
+
+    profiles = {p["UserProfileName"]: p for p in snapshot["user_profiles"]}
+    spaces = {s["SpaceName"]: s for s in snapshot["spaces"]}
+
+    teams = {}
+    total = {key: 0 for key, _ in COLUMNS}
+    space_teams = {}
+    roster_usernames = set()
+
+    for user_email, team in users.items():
+        team = str(team)
+        username = get_username_from_email(user_email)
+        space_names = get_user_space_names(user_email, team, space_mode)
+
+        roster_usernames.add(username)
+        for space_name in space_names:
+            space_teams[space_name] = team
+
+        state = get_user_state(
+            profiles.get(username), [spaces.get(name) for name in space_names]
+        )
+
+        counts = teams.setdefault(team, {key: 0 for key, _ in COLUMNS})
+        for target in (counts, total):
+            target["users"] += 1
+            target[state] += 1
+
+    orphans = {
+        "user_profiles": len(set(profiles) - roster_usernames),
+        "spaces": len(set(spaces) - set(space_teams)),
+        "apps": 0,
+    }
+
+    for app in snapshot["apps"]:
+        if app["Status"] == "InService":
+            state = "apps_running"
+        elif app["Status"] == "Pending":
+            state = "apps_pending"
+        else:
+            # Deleted or on its way out
+            continue
+
+        team = space_teams.get(app.get("SpaceName"))
+        if team is None:
+            orphans["apps"] += 1
+            continue
+
+        teams[team][state] += 1
+        total[state] += 1
+
+    return {"teams": teams, "total": total, "orphans": orphans}
+
+
+def merge_summaries(summaries: list) -> dict:
+    """Adds up the summaries of several domains
+
+    Parameters:
+        summaries (list): Summaries from summarize_status
+
+    Returns:
+        dict: Summary covering all domains
+    """
+
+    merged = {
+        "teams": {},
+        "total": {key: 0 for key, _ in COLUMNS},
+        "orphans": {"user_profiles": 0, "spaces": 0, "apps": 0},
+    }
+
+    for summary in summaries:
+        for team, counts in summary["teams"].items():
+            team_counts = merged["teams"].setdefault(team, {key: 0 for key, _ in COLUMNS})
+            for key, _ in COLUMNS:
+                team_counts[key] += counts[key]
+
+        for key, _ in COLUMNS:
+            merged["total"][key] += summary["total"][key]
+
+        for key in merged["orphans"]:
+            merged["orphans"][key] += summary["orphans"][key]
+
+    return merged
+
+
+def format_status(summary: dict, previous: dict = None) -> str:
+    """Renders a status summary as a table
+
+    Parameters:
+        summary (dict): Summary from summarize_status
+        previous (dict): (optional) Summary from the previous refresh. Changes in the totals are shown next to each count
+
+    Returns:
+        str: Printable table
+    """
+
+    headers = ["Team"] + [title for _, title in COLUMNS]
+    rows = []
+
+    def sort_key(team):
+        return (0, int(team)) if team.isnumeric() else (1, team)
+
+    for team in sorted(summary["teams"], key=sort_key):
+        counts = summary["teams"][team]
+        rows.append([team] + [str(counts[key]) for key, _ in COLUMNS])
+
+    total_row = ["Total"]
+    for key, _ in COLUMNS:
+        cell = str(summary["total"][key])
+        if previous:
+            delta = summary["total"][key] - previous["total"][key]
+            if delta:
+                cell += f" ({delta:+d})"
+        total_row.append(cell)
+
+    widths = [
+        max(len(row[i]) for row in [headers, total_row] + rows)
+        for i in range(len(headers))
+    ]
+
+    def format_row(row):
+        cells = [cell.ljust(width) for cell, width in zip(row, widths)]
+        return "  ".join(cells).rstrip()
+
+    lines = [format_row(headers), "  ".join("-" * width for width in widths)]
+    lines.extend(format_row(row) for row in rows)
+    lines.append("  ".join("-" * width for width in widths))
+    lines.append(format_row(total_row))
+
+    orphans = summary["orphans"]
+    lines.append(
+        f"\nOrphaned resources (not in roster): {orphans['user_profiles']} user profiles, "
+        f"{orphans['spaces']} spaces, {orphans['apps']} apps"
+    )
+
+    return "\n".join(lines)
@@ -0,0 +1,277 @@
+import time
+
+import boto3
+import botocore
+import click
+
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.dynamodb.conditions import Attr
+
+from studio.utils.aws import (
+    INTERNAL_KEY_PREFIX,
+    delete_apps,
+    get_client,
+    get_code_editor_space_name,
+    get_domain_snapshot,
+    get_jupyter_space_name,
+    get_space_mode,
+    get_team_space_name,
+    get_user_items_from_ddb,
+    get_username_from_email,
+    list_domain_resources,
+)
+from studio.utils.progress import Progress
+from studio.utils.throttle import RateLimiter
+
+SUSPENDED_KEY_PREFIX = f"{INTERNAL_KEY_PREFIX}suspended#"
+
+
+def get_suspended_key(domain_id: str, app: dict) -> str:
+    """Gets the DDB key recording that an app was suspended"""
+
+    return (
+        f"{SUSPENDED_KEY_PREFIX}{domain_id}#{app['SpaceName']}#"
+        f"{app['AppType']}#{app['AppName']}"
+    )
+
+
+def get_space_owners(user_items: dict) -> dict:
+    """Maps each space of the roster to its team and users
+
+    Parameters:
+        user_items (dict): {'email': item} as returned by get_user_items_from_ddb
+
+    Returns:
+        dict: {'space name': {'team': team, 'users': [emails]}}
+    """
+
+    space_mode = get_space_mode(user_items)
+    owners = {}
+
+    for user_email, item in user_items.items():
+        team = str(item["team"])
+        username = get_username_from_email(user_email)
+
+        if space_mode == "team":
+            space_names = [get_team_space_name(team)]
+        else:
+            space_names = [
+                get_jupyter_space_name(username),
+                get_code_editor_space_name(username),
+            ]
+
+        for space_name in space_names:
+            owner = owners.setdefault(space_name, {"team": team, "users": []})
+            owner["users"].append(user_email)
+
+    return owners
+
+
+def suspend_apps(config: object, rate: float = 2, progress: Progress = None) -> bool:
+    """Records and deletes all running apps in the domain, keeping spaces in place
+
+    Every running app is recorded in DDB before anything is deleted, so resume
+    only restarts what was running, even if the suspend is interrupted. With
+    an event ID configured, only the event's apps are suspended.
+
+    Parameters:
+        config (object): CLI configuration object.
+        rate (float): DeleteApp requests per second. 0 for no limit
+        progress (Progress): (optional) Tracks progress under 'apps'
+
+    Returns:
+        bool: True if all running apps were deleted
+    """
+
+    sm_client = get_client("sagemaker", config.region)
+    table = boto3.resource("dynamodb", config.region).Table(config.table_name)
+
+    if config.event_id:
+        # Other events share the domain. Leave their apps running
+        apps = get_domain_snapshot(config)["apps"]
+    else:
+        apps = list_domain_resources(sm_client, "list_apps", "Apps", config.domain_id)
+
+    apps = [
+        app for app in apps if app["Status"] == "InService" and app.get("SpaceName")
+    ]
+
+    if not apps:
+        click.echo("No running apps to suspend.")
+        return True
+
+    owners = get_space_owners(get_user_items_from_ddb(config))
+    suspended_at = int(time.time())
+
+    with table.batch_writer() as batch:
+        for app in apps:
+            owner = owners.get(app["SpaceName"], {"team": "", "users": []})
+            item = {
+                "pk": get_suspended_key(config.domain_id, app),
+                "domain-id": config.domain_id,
+                "space-name": app["SpaceName"],
+                "app-type": app["AppType"],
+                "app-name": app["AppName"],
+                "team": owner["team"],
+                "users": owner["users"],
+                "suspended-at": suspended_at,
+            }
+            if app.get("ResourceSpec"):
+                item["resource-spec"] = app["ResourceSpec"]
+
+            batch.put_item(Item=item)
+
+    click.echo(f"Recorded {len(apps)} running apps in DynamoDB.")
+
+    return delete_apps(config, apps, progress, RateLimiter(rate))
+
+
+def get_suspended_apps(config: object) -> list:
+    """Gets the apps recorded by suspend_apps for the configured domain
+
+    Parameters:
+        config (object): CLI configuration object.
+
+    Returns:
+        list: Suspension records
+    """
+
+    table = boto3.resource("dynamodb", config.region).Table(config.table_name)
+
+    params = {
+        "FilterExpression": Attr("pk").begins_with(
+            f"{SUSPENDED_KEY_PREFIX}{config.domain_id}#"
+        )
+    }
+    records = []
+
+    while True:
+        response = table.scan(**params)
+        records.extend(response.get("Items", []))
+
+        if "LastEvaluatedKey" not in response:
+            break
+        params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    return records
+
+
+def resume_apps(
+    config: object,
+    teams: list = None,
+    users: list = None,
+    wave_size: int = 25,
+    wave_interval: int = 30,
+    progress: Progress = None,
+) -> bool:
+    """Restarts suspended apps in waves
+
+    Only apps recorded by suspend_apps are restarted. Records are removed once
+    their app is started, so resume can be run again for the remaining ones.
+
+    Parameters:
+        config (object): CLI configuration object.
+        teams (list): (optional) Only resume the apps of these teams
+        users (list): (optional) Only resume the apps of these users (emails)
+        wave_size (int): Number of apps started per wave
+        wave_interval (int): Seconds between waves
+        progress (Progress): (optional) Tracks progress under 'apps'
+
+    Returns:
+        bool: True if all selected apps were started
+    """
+
+    sm_client = get_client("sagemaker", config.region)
+    table = boto3.resource("dynamodb", config.region).Table(config.table_name)
+    progress = progress or Progress()
+
+    records = get_suspended_apps(config)
+
+    if teams or users:
+        teams = {str(team) for team in teams or []}
+        users = set(users or [])
+        records = [
+            record
+            for record in records
+            if record["team"] in teams or users.intersection(record["users"])
+        ]
+
+    if not records:
+        click.echo("No suspended apps to resume.")
+        return True
+
+    def create_app(record):
+        params = {
+            "DomainId": config.domain_id,
+            "SpaceName": record["space-name"],
+            "AppType": record["app-type"],
+            "AppName": record["app-name"],
+        }
+        if record.get("resource-spec"):
+            params["ResourceSpec"] = record["resource-spec"]
+
+        while True:
+            try:
+                sm_client.create_app(**params)
+                break
+
+            except sm_client.exceptions.ResourceInUse:
+                # Already running
+                break
+
+            except sm_client.exceptions.ResourceNotFound:
+                click.secho(
+                    f"Space {record['space-name']} no longer exists, skipping.",
+                    fg="yellow",
+                )
+                break
+
+            except botocore.exceptions.ClientError as e:
+                if e.response["Error"]["Code"] == "ThrottlingException":
+                    progress.throttle("apps")
+                    time.sleep(5)
+                    continue
+
+                click.secho(
+                    f"Couldn't start {record['app-type']} in space {record['space-name']}:\n {e}",
+                    fg="red",
+                )
+                return False
+
+        table.delete_item(Key={"pk": record["pk"]})
+        return True
+
+    click.echo(f"\n** Resuming {len(records)} apps in waves of {wave_size}... **")
+
+    progress.add("apps", len(records))
+    results = []
+
+    def sort_key(record):
+        # Teams are stored as strings. Keep team 2 ahead of team 10
+        team = record["team"]
+        team_key = (0, int(team)) if team.isnumeric() else (1, team)
+        return team_key, record["space-name"]
+
+    # Sort so each wave brings up whole teams
+    records.sort(key=sort_key)
+
+    for start in range(0, len(records), wave_size):
+        if start:
+            time.sleep(wave_interval)
+
+        wave = records[start : start + wave_size]
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            results.extend(executor.map(progress.track("apps", create_app), wave))
+
+    resumed_all = all(results)
+
+    if resumed_all:
+        click.echo("All apps resumed successfully.")
+    else:
+        click.secho(
+            "Not all apps were resumed. Run resume again to retry the remaining ones.",
+            fg="red",
+        )
+
+    return resumed_all
@@ -0,0 +1,48 @@
+import threading
+import time
+
+
+class RateLimiter(object):
+    """Thread-safe token bucket limiting how many operations are started per second
+
+    A rate of 0 or None means no limit.
+    """
+
+    def __init__(self, rate: float, burst: float = None) -> None:
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> None:
+        """Blocks until the requested number of tokens are available
+
+        Parameters:
+            tokens (float): Number of tokens to take, i.e write capacity units
+
+        Returns:
+            None
+        """
+
+        if not self.rate:
+            return
+
+        # A request bigger than the bucket would never fit. Let it drain the bucket instead.
+        tokens = min(tokens, self.capacity)
+
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+
+                time_to_wait = (tokens - self.tokens) / self.rate
+
+            time.sleep(time_to_wait)
@@ -0,0 +1,223 @@
+import collections
+import json
+import threading
+import time
+
+import boto3
+import click
+
+from botocore import parsers
+from botocore.awsrequest import AWSResponse, HeadersDict
+
+from studio.utils.state import open_state_file
+
+# Values of these keys never end up in a trace
+REDACTED_KEYS = [
+    "AuthorizedUrl",
+    "AccessKeyId",
+    "SecretAccessKey",
+    "SessionToken",
+    "Credentials",
+]
+REDACTED = "REDACTED"
+
+
+def redact(value: object) -> object:
+    """Replaces credentials and presigned URLs in API parameters or response bodies
+
+    Also turns values JSON can't hold, like datetimes in parameters, into strings.
+    """
+
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if key in REDACTED_KEYS else redact(item)
+            for key, item in value.items()
+            if key != "ResponseMetadata"
+        }
+
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+
+    return str(value)
+
+
+def get_call_key(service: str, operation: str, params: dict) -> tuple:
+    """Gets the key a call is matched on when replaying"""
+
+    return service, operation, json.dumps(params, sort_keys=True)
+
+
+def get_service(model) -> str:
+    return model.service_model.service_name
+
+
+def redact_body(body: bytes) -> str:
+    """Redacts a JSON response body, as all services used here send
+
+    Other bodies are kept as they are.
+    """
+
+    text = body.decode("utf-8")
+    try:
+        return json.dumps(redact(json.loads(text)), separators=(",", ":"))
+    except ValueError:
+        return text
+
+
+class Recorder(object):
+    """Writes every AWS call made by this process to a trace file
+
+    Each call is one JSON line with the operation, its parameters, the HTTP
+    response and how long it took, offset from the start of the recording.
+    The response is recorded as it came over the wire, before botocore or a
+    resource like DynamoDB's transformed it, so it's parsed again the same way
+    when replayed.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open_state_file(path, "w")
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.calls = 0
+
+    def start(self) -> None:
+        """Hooks into every client and resource created from now on"""
+
+        events = boto3._get_default_session().events
+        events.register("before-parameter-build", self.before_parameter_build)
+        events.register("after-call", self.after_call)
+
+    def before_parameter_build(self, params, model, context, **kwargs):
+        context["trace"] = {
+            "params": redact(params),
+            "start": time.monotonic(),
+        }
+
+    def after_call(self, http_response, parsed, model, context, **kwargs):
+        trace = context.get("trace")
+        if trace is None:
+            return
+
+        call = {
+            "offset": round(trace["start"] - self.started, 6),
+            "duration": round(time.monotonic() - trace["start"], 6),
+            "service": get_service(model),
+            "operation": model.name,
+            "params": trace["params"],
+            "status": http_response.status_code,
+            "headers": dict(http_response.headers.items()),
+            # Streamed bodies are left for the caller to read
+            "body": (
+                ""
+                if model.has_streaming_output
+                else redact_body(http_response.content)
+            ),
+        }
+
+        with self.lock:
+            self.file.write(json.dumps(call, separators=(",", ":")) + "\n")
+            self.calls += 1
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
+
+        click.secho(f"Recorded {self.calls} AWS calls to {self.path}", fg="cyan", err=True)
+
+
+class Replayer(object):
+    """Answers AWS calls from a trace file instead of AWS
+
+    Calls are matched on their operation and parameters, in the order they
+    were recorded, so retry loops see the same sequence of states. Each
+    answer is delayed by the recorded duration to keep the original timing.
+    Calls whose parameters weren't recorded, like calls with a different
+    pagination token, get the next recorded answer for the same operation.
+    """
+
+    def __init__(self, path: str, speed: float = 1) -> None:
+        self.path = path
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.calls = collections.defaultdict(collections.deque)
+        self.by_operation = collections.defaultdict(collections.deque)
+        self.replayed = 0
+
+        with open_state_file(path, "r") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+
+                call = json.loads(line)
+                self.calls[
+                    get_call_key(call["service"], call["operation"], call["params"])
+                ].append(call)
+                self.by_operation[(call["service"], call["operation"])].append(call)
+
+    def start(self) -> None:
+        """Hooks into every client and resource created from now on"""
+
+        events = boto3._get_default_session().events
+        events.register("before-parameter-build", self.before_parameter_build)
+        events.register("before-call", self.before_call)
+
+    def before_parameter_build(self, params, model, context, **kwargs):
+        context["trace_params"] = redact(params)
+
+    def _take(self, service: str, operation: str, params: dict) -> dict:
+        with self.lock:
+            calls = self.calls[get_call_key(service, operation, params)]
+            fallback = self.by_operation[(service, operation)]
+
+            # Calls are in both queues. Take them out of both.
+            call = calls.popleft() if calls else None
+            if call is None and fallback:
+                call = fallback[0]
+                key = get_call_key(service, operation, call["params"])
+                self.calls[key].remove(call)
+
+            if call is not None:
+                fallback.remove(call)
+                self.replayed += 1
+
+            return call
+
+    def before_call(self, model, context, **kwargs):
+        service = get_service(model)
+        call = self._take(service, model.name, context.get("trace_params", {}))
+
+        if call is None:
+            raise RuntimeError(
+                f"No recorded response left for {service} {model.name} in {self.path}"
+            )
+
+        if self.speed:
+            time.sleep(call["duration"] / self.speed)
+
+        # Parsed like a response from AWS, so timestamps are datetimes and resources
+        # transform it as usual. Errors are raised from the status code
+        headers = HeadersDict(call["headers"])
+        response_dict = {
+            "headers": headers,
+            "status_code": call["status"],
+            "body": call["body"].encode("utf-8"),
+            "context": {"operation_name": model.name},
+        }
+        parser = parsers.create_parser(model.service_model.resolved_protocol)
+        parsed = parser.parse(response_dict, model.output_shape)
+
+        # Returning a response skips sending the request
+        http_response = AWSResponse(None, call["status"], headers, None)
+        return http_response, parsed
+
+    def close(self) -> None:
+        left = sum(len(calls) for calls in self.by_operation.values())
+        click.secho(
+            f"Replayed {self.replayed} AWS calls from {self.path}, {left} not used",
+            fg="cyan",
+            err=True,
+        )
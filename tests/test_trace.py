@@ -0,0 +1,87 @@
+import datetime
+import decimal
+
+import boto3
+import pytest
+
+from moto import mock_aws
+
+from studio.utils.trace import Recorder, Replayer
+
+REGION = "us-east-1"
+TABLE = "studio-cli-test"
+
+
+@pytest.fixture(autouse=True)
+def session(monkeypatch):
+    """Gives each test a fresh default session, so hooks don't leak between tests"""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_SESSION_TOKEN", "testing")
+    boto3.setup_default_session(region_name=REGION)
+    yield
+    boto3.DEFAULT_SESSION = None
+
+
+def make_calls() -> dict:
+    """Makes the client and resource calls the CLI makes against DynamoDB"""
+    client = boto3.client("dynamodb", region_name=REGION)
+    client.create_table(
+        TableName=TABLE,
+        AttributeDefinitions=[{"AttributeName": "pk", "AttributeType": "S"}],
+        KeySchema=[{"AttributeName": "pk", "KeyType": "HASH"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
+
+    table = boto3.resource("dynamodb", region_name=REGION).Table(TABLE)
+    table.put_item(Item={"pk": "jane@example.com", "team": 1, "status": "ready"})
+    table.put_item(Item={"pk": "john@example.com", "team": 2, "status": "pending"})
+
+    try:
+        client.describe_table(TableName="missing")
+        missing = None
+    except client.exceptions.ResourceNotFoundException as e:
+        missing = e.response["Error"]["Code"]
+
+    return {
+        "item": table.get_item(Key={"pk": "jane@example.com"})["Item"],
+        "scan": sorted(table.scan()["Items"], key=lambda item: item["pk"]),
+        "created": client.describe_table(TableName=TABLE)["Table"]["CreationDateTime"],
+        "missing": missing,
+    }
+
+
+@pytest.mark.parametrize("name", ["trace.ndjson", "trace.ndjson.gz"])
+def test_replay_matches_recording(tmp_path, name):
+    path = str(tmp_path / name)
+
+    with mock_aws():
+        # moto resets the default session when it starts. Hook into the new one
+        recorder = Recorder(path)
+        recorder.start()
+        recorded = make_calls()
+        recorder.close()
+
+    boto3.setup_default_session(region_name=REGION)
+    replayer = Replayer(path, speed=0)
+    replayer.start()
+    # No moto. Every call is answered from the trace
+    replayed = make_calls()
+    replayer.close()
+
+    assert replayed == recorded
+    assert replayed["scan"][0]["team"] == decimal.Decimal(1)
+    assert isinstance(replayed["created"], datetime.datetime)
+    assert replayed["missing"] == "ResourceNotFoundException"
+    assert replayer.replayed == recorder.calls
+
+
+def test_replay_without_recorded_call(tmp_path):
+    path = str(tmp_path / "trace.ndjson")
+    Recorder(path).close()
+
+    replayer = Replayer(path, speed=0)
+    replayer.start()
+
+    with pytest.raises(RuntimeError, match="No recorded response left"):
+        boto3.client("dynamodb", region_name=REGION).list_tables()
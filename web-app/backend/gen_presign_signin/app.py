@@ -1,22 +1,179 @@
 import json
+import os
 import re
+import time
 import boto3
-from aws_lambda_powertools import Logger
+import botocore
+from contextlib import contextmanager
+from functools import wraps
+from aws_lambda_powertools import Logger, Metrics, single_metric
 from aws_lambda_powertools.logging import correlation_paths
+from aws_lambda_powertools.metrics import MetricUnit
+
+METRICS_NAMESPACE = os.environ.get("POWERTOOLS_METRICS_NAMESPACE", "StudioCli")
 
 logger = Logger()
+metrics = Metrics(namespace=METRICS_NAMESPACE)
 
 ddb_client = boto3.client("dynamodb")
 dynamodb_resource = boto3.resource("dynamodb")
 sm_client = boto3.client("sagemaker")
 
-table = ""
+# Clients for other regions, created on the first login of a participant there
+regional_clients = {}
+
+# Tables holding the participants, as comma separated region/table pairs, i.e
+# "eu-west-1/studio-cli-1700000000,us-east-1/studio-cli-1700000001". Needed when
+# studio-cli profiles use other regions or tables, `studio configure` prints the
+# value to use. Defaults to the studio-cli tables in the Lambda's region.
+STATE_TABLES = os.environ.get("STATE_TABLES", "")
+
+tables = []
+
+# Where participants land when the request doesn't say: home, jupyter or code-editor
+DEFAULT_LANDING = os.environ.get("DEFAULT_LANDING", "home")
+
+# How long participants are asked to wait when their environment is still being set up
+RETRY_AFTER_SECONDS = 30
+
+# Users set up with `studio setup-users --jit` get their user profile and spaces
+# created here, on their first login. They're on-demand until then, and preparing
+# while the resources are being created.
+JIT_STATUSES = ["on-demand", "preparing"]
+JIT_RETRY_SECONDS = 10
+
+# How long one request may hold the lock on provisioning a user
+JIT_LOCK_SECONDS = 20
+
+FAILED_STATUSES = ["Failed", "Update_Failed", "Delete_Failed"]
+
+# Errors that retrying won't fix, like running out of quota. The user is marked failed
+PERMANENT_ERRORS = ["ResourceLimitExceeded", "ValidationException"]
+
+
+@contextmanager
+def timed(stage: str):
+    """Records how long a stage of the request took as a <stage>Latency metric"""
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_metric(
+            name=f"{stage}Latency",
+            unit=MetricUnit.Milliseconds,
+            value=(time.perf_counter() - start) * 1000,
+        )
+
+
+def get_tables() -> list:
+    """Gets the tables holding participants, cached for the lifetime of the execution environment
+
+    Returns:
+        list: (region, table name) pairs, region None for the Lambda's own region.
+            Empty if the event is not initialized
+    """
+
+    global tables
+
+    if tables:
+        metrics.add_metric(name="TableCacheHit", unit=MetricUnit.Count, value=1)
+        return tables
+
+    metrics.add_metric(name="TableCacheMiss", unit=MetricUnit.Count, value=1)
+
+    if STATE_TABLES:
+        for pair in STATE_TABLES.split(","):
+            # A table without a region is in the Lambda's region
+            region, _, table_name = pair.strip().rpartition("/")
+            if table_name:
+                tables.append((region or None, table_name))
+        return tables
+
+    # Check that there's a table starting with studio-cli-. If not, event is not initialized
+    with timed("TableResolution"):
+        response = ddb_client.list_tables()
+
+    tables = [
+        (None, name) for name in response["TableNames"] if name.startswith("studio-cli-")
+    ]
+
+    return tables
+
+
+def get_regional_clients(region: str) -> tuple:
+    """Gets the DynamoDB resource and SageMaker client for a region
+
+    Returns:
+        tuple: (DynamoDB resource, SageMaker client)
+    """
+
+    if region is None:
+        return dynamodb_resource, sm_client
+
+    if region not in regional_clients:
+        regional_clients[region] = (
+            boto3.resource("dynamodb", region_name=region),
+            boto3.client("sagemaker", region_name=region),
+        )
+
+    return regional_clients[region]
+
+
+def find_user(email: str) -> tuple:
+    """Looks a participant up in the tables, in order
+
+    Each table is in the region of the domains it holds participants for.
+
+    Returns:
+        tuple: (user item, DDB table, SageMaker client for the user's domain), or (None, None, None)
+    """
+
+    for region, table_name in get_tables():
+        ddb_resource, regional_sm_client = get_regional_clients(region)
+        ddb_table = ddb_resource.Table(table_name)
+
+        with timed("GetItem"):
+            response = ddb_table.get_item(Key={"pk": email})
+
+        if "Item" in response:
+            return response["Item"], ddb_table, regional_sm_client
 
-# Check that there's a table starting with studio-cli-. If not, event is not initialized
-response = ddb_client.list_tables()
-table_list = [i for i in response["TableNames"] if i.startswith("studio-cli-")]
-if table_list:
-    table = table_list[0]
+    return None, None, None
+
+
+def record_outcome(handler):
+    """Records the total latency and status code of each invocation
+
+    Each invocation emits one Requests metric with an Outcome dimension holding
+    the status code, so outcomes can be graphed and alarmed on separately.
+    """
+
+    @wraps(handler)
+    def wrapper(event, context):
+        metrics.add_metadata(key="correlation_id", value=logger.get_correlation_id())
+
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            response = handler(event, context)
+            outcome = str(response["statusCode"])
+            return response
+        finally:
+            metrics.add_metric(
+                name="HandlerLatency",
+                unit=MetricUnit.Milliseconds,
+                value=(time.perf_counter() - start) * 1000,
+            )
+            with single_metric(
+                name="Requests",
+                unit=MetricUnit.Count,
+                value=1,
+                namespace=METRICS_NAMESPACE,
+            ) as metric:
+                metric.add_dimension(name="Outcome", value=outcome)
+
+    return wrapper
 
 
 def get_username_from_email(email: str) -> str:
@@ -33,7 +190,252 @@ def get_username_from_email(email: str) -> str:
     return username
 
 
-def get_response_body(message, presigned=""):
+def get_landing_target(landing: str, username: str, team: int = None) -> tuple:
+    """Gets the space and landing URI a presigned URL should point to
+
+    Parameters:
+        landing (str): home, jupyter or code-editor
+        username (str): username
+        team (int): (optional) The user's team, if users share one space per team
+
+    Returns:
+        tuple: (space name, landing URI), or (None, None) for the Studio home page
+    """
+
+    if landing != "home" and team is not None:
+        # Team spaces are JupyterLab spaces
+        return f"team-{team}-space", "app:JupyterLab:"
+
+    if landing == "jupyter":
+        return f"{username}-jupyter-space", "app:JupyterLab:"
+
+    if landing == "code-editor":
+        return f"{username}-ce-space", "app:CodeEditor:"
+
+    return None, None
+
+
+def is_space_ready(sm_client, domain_id: str, space_name: str) -> bool:
+    """Checks whether a space is InService
+
+    Parameters:
+        sm_client: SageMaker client for the domain's region
+        domain_id (str): SageMaker Studio Domain ID
+        space_name (str): Name of the space
+
+    Returns:
+        bool: True if the space can be landed in
+    """
+
+    try:
+        with timed("DescribeSpace"):
+            response = sm_client.describe_space(
+                DomainId=domain_id, SpaceName=space_name
+            )
+    except sm_client.exceptions.ResourceNotFound:
+        return False
+
+    return response["Status"] == "InService"
+
+
+def get_user_spaces(username: str, team: int = None) -> list:
+    """Gets the spaces a user needs, like setup-users creates them
+
+    Returns:
+        list: (space name, app type, sharing type) for each space
+    """
+
+    if team is not None:
+        return [(f"team-{team}-space", "JupyterLab", "Shared")]
+
+    return [
+        (f"{username}-jupyter-space", "JupyterLab", "Private"),
+        (f"{username}-ce-space", "CodeEditor", "Private"),
+    ]
+
+
+def get_event_tags(user_item: dict, resource_name: str) -> dict:
+    """Gets the tags setup-users would put on a resource of the user's event"""
+
+    if "event-id" not in user_item:
+        return {}
+
+    return {
+        "Tags": [
+            {"Key": "studio-cli:event-id", "Value": user_item["event-id"]},
+            {"Key": "studio-cli:resource-name", "Value": resource_name},
+        ]
+    }
+
+
+def claim_provisioning_lock(ddb_table, user_email: str) -> int:
+    """Claims the lock on provisioning a user with a conditional write
+
+    Returns:
+        int: Expiry of the lock, or 0 if another request holds it
+    """
+
+    now = int(time.time())
+    expires = now + JIT_LOCK_SECONDS
+
+    try:
+        ddb_table.update_item(
+            Key={"pk": user_email},
+            UpdateExpression="SET #status = :preparing, #lock = :expires, #updated = :now",
+            ConditionExpression="#status IN (:on_demand, :preparing) AND "
+            "(attribute_not_exists(#lock) OR #lock < :now)",
+            ExpressionAttributeNames={
+                "#status": "provisioning-status",
+                "#lock": "lock-expires",
+                "#updated": "updated-at",
+            },
+            ExpressionAttributeValues={
+                ":preparing": "preparing",
+                ":on_demand": "on-demand",
+                ":expires": expires,
+                ":now": now,
+            },
+        )
+        return expires
+
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return 0
+        raise
+
+
+def release_provisioning_lock(
+    ddb_table, user_email: str, expires: int, status: str
+) -> None:
+    """Stores the provisioning status and releases the lock, if still held"""
+
+    try:
+        ddb_table.update_item(
+            Key={"pk": user_email},
+            UpdateExpression="SET #status = :status, #updated = :now REMOVE #lock",
+            ConditionExpression="#lock = :expires",
+            ExpressionAttributeNames={
+                "#status": "provisioning-status",
+                "#lock": "lock-expires",
+                "#updated": "updated-at",
+            },
+            ExpressionAttributeValues={
+                ":status": status,
+                ":expires": expires,
+                ":now": int(time.time()),
+            },
+        )
+
+    except botocore.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        # The lock expired and was taken over. The next request picks up from here
+        logger.warning(f"Lost the provisioning lock on {user_email}")
+
+
+def create_if_missing(sm_client, create, **params) -> None:
+    """Calls a SageMaker create operation, ignoring resources that already exist"""
+
+    try:
+        create(**params)
+    except sm_client.exceptions.ResourceInUse:
+        # Created by a concurrent request, i.e a teammate creating their team space
+        pass
+
+
+def provision_user(sm_client, user_item: dict, username: str, team: int = None) -> str:
+    """Moves the provisioning of a user one step forward
+
+    Each call creates what's missing and checks what's being created, without
+    waiting for it. Participants retry until everything is InService.
+
+    Returns:
+        str: 'ready', 'preparing' or 'failed'
+    """
+
+    domain_id = user_item["domain-id"]
+
+    try:
+        profile = sm_client.describe_user_profile(
+            DomainId=domain_id, UserProfileName=username
+        )
+    except sm_client.exceptions.ResourceNotFound:
+        create_if_missing(
+            sm_client,
+            sm_client.create_user_profile,
+            DomainId=domain_id,
+            UserProfileName=username,
+            **get_event_tags(user_item, username),
+        )
+        return "preparing"
+
+    if profile["Status"] in FAILED_STATUSES:
+        return "failed"
+
+    if profile["Status"] != "InService":
+        # Spaces can only be created for a user profile that's InService
+        return "preparing"
+
+    status = "ready"
+    for space_name, app_type, sharing_type in get_user_spaces(username, team):
+        try:
+            space = sm_client.describe_space(DomainId=domain_id, SpaceName=space_name)
+        except sm_client.exceptions.ResourceNotFound:
+            create_if_missing(
+                sm_client,
+                sm_client.create_space,
+                DomainId=domain_id,
+                SpaceName=space_name,
+                OwnershipSettings={"OwnerUserProfileName": username},
+                SpaceSettings={"AppType": app_type},
+                SpaceSharingSettings={"SharingType": sharing_type},
+                **get_event_tags(user_item, space_name),
+            )
+            status = "preparing"
+            continue
+
+        if space["Status"] in FAILED_STATUSES:
+            return "failed"
+
+        if space["Status"] != "InService":
+            status = "preparing"
+
+    return status
+
+
+def provision_on_demand(
+    ddb_table, sm_client, user_item: dict, username: str, team: int = None
+) -> str:
+    """Provisions a user on their first logins, one request at a time
+
+    Returns:
+        str: 'ready', 'preparing' or 'failed'
+    """
+
+    expires = claim_provisioning_lock(ddb_table, user_item["pk"])
+    if not expires:
+        # Another request for this user is provisioning right now
+        return "preparing"
+
+    status = "preparing"
+    try:
+        with timed("Provisioning"):
+            status = provision_user(sm_client, user_item, username, team)
+
+    except botocore.exceptions.ClientError as e:
+        logger.error(e)
+        if e.response["Error"]["Code"] in PERMANENT_ERRORS:
+            # Participants would otherwise keep retrying until an organiser steps in
+            status = "failed"
+        # Otherwise throttled. The next request tries again
+
+    finally:
+        release_provisioning_lock(ddb_table, user_item["pk"], expires, status)
+
+    return status
+
+
+def get_response_body(message, presigned="", retry_after=None):
     """Return stringified response body object
 
     Parameters:
@@ -41,6 +443,8 @@ def get_response_body(message, presigned=""):
 
         presigned (str): (optional) Presigned URL
 
+        retry_after (int): (optional) Seconds after which the client should try again
+
     Returns:
         str: Stringified dict with message and potentially the presigned URL
     """
@@ -48,18 +452,23 @@ def get_response_body(message, presigned=""):
     if presigned:
         return json.dumps({"message": message, "presigned": presigned})
 
+    if retry_after:
+        return json.dumps({"message": message, "retryAfter": retry_after})
+
     return json.dumps({"message": message})
 
 
+@metrics.log_metrics(capture_cold_start_metric=True)
 @logger.inject_lambda_context(
     correlation_id_path=correlation_paths.API_GATEWAY_REST, log_event=True
 )
+@record_outcome
 def lambda_handler(event, context):
     response_headers = {
         "Access-Control-Allow-Origin": "*",
     }
 
-    if not table:
+    if not get_tables():
         logger.error("No DDB table was found")
         return {
             "statusCode": 404,
@@ -82,10 +491,9 @@ def lambda_handler(event, context):
 
     body = json.loads(body)
 
-    ddb_table = dynamodb_resource.Table(table)
-    response = ddb_table.get_item(Key={"pk": body["email"]})
+    user_item, ddb_table, sm_client = find_user(body["email"])
 
-    if "Item" not in response:
+    if user_item is None:
         # user is not in DDB
         return {
             "statusCode": 404,
@@ -95,23 +503,100 @@ def lambda_handler(event, context):
             ),
         }
 
-    logger.info(response)
+    logger.info(user_item)
+
+    # DynamoDB deletes expired users lazily, so the window is checked here too
+    now = time.time()
+    if "access-start" in user_item and now < user_item["access-start"]:
+        return {
+            "statusCode": 403,
+            "headers": response_headers,
+            "body": get_response_body("The event hasn't started yet"),
+        }
 
-    user_item = response["Item"]
+    if "access-end" in user_item and now > user_item["access-end"]:
+        return {
+            "statusCode": 403,
+            "headers": response_headers,
+            "body": get_response_body("The event is over"),
+        }
 
     username = get_username_from_email(user_item["pk"])
-    space_name = f"{username}-space"
     domain_id = user_item["domain-id"]
+    team = user_item["team"] if user_item.get("space-mode") == "team" else None
 
-    try:
-        response = sm_client.create_presigned_domain_url(
-            DomainId=domain_id,
-            UserProfileName=username,
-            SessionExpirationDurationInSeconds=43200,  # 3 days
-            ExpiresInSeconds=300,  # 5 minutes
-            # SpaceName=space_name,
+    # Users set up by older versions of studio-cli have no provisioning status
+    provisioning_status = user_item.get("provisioning-status", "ready")
+
+    if provisioning_status in JIT_STATUSES:
+        provisioning_status = provision_on_demand(
+            ddb_table, sm_client, user_item, username, team
         )
 
+    if provisioning_status == "failed":
+        logger.error(f"Provisioning failed for {user_item['pk']}")
+        return {
+            "statusCode": 500,
+            "headers": response_headers,
+            "body": get_response_body(
+                "Your environment could not be set up. Please ask an organiser for help"
+            ),
+        }
+
+    if provisioning_status == "preparing":
+        return {
+            "statusCode": 202,
+            "headers": {**response_headers, "Retry-After": str(JIT_RETRY_SECONDS)},
+            "body": get_response_body(
+                f"Preparing your environment. Retrying in {JIT_RETRY_SECONDS} seconds",
+                retry_after=JIT_RETRY_SECONDS,
+            ),
+        }
+
+    if provisioning_status != "ready":
+        return {
+            "statusCode": 202,
+            "headers": {**response_headers, "Retry-After": str(RETRY_AFTER_SECONDS)},
+            "body": get_response_body(
+                f"Your environment is still being set up. Retrying in {RETRY_AFTER_SECONDS} seconds",
+                retry_after=RETRY_AFTER_SECONDS,
+            ),
+        }
+
+    params = {
+        "DomainId": domain_id,
+        "UserProfileName": username,
+        "SessionExpirationDurationInSeconds": 43200,  # 3 days
+        "ExpiresInSeconds": 300,  # 5 minutes
+    }
+
+    space_name, landing_uri = get_landing_target(
+        body.get("landing", DEFAULT_LANDING), username, team
+    )
+    if space_name and is_space_ready(sm_client, domain_id, space_name):
+        params["SpaceName"] = space_name
+        params["LandingUri"] = landing_uri
+    elif space_name:
+        logger.info(f"Space {space_name} is not ready, landing on the home page")
+
+    try:
+        try:
+            with timed("CreatePresignedUrl"):
+                response = sm_client.create_presigned_domain_url(**params)
+        except botocore.exceptions.ClientError as e:
+            if "SpaceName" not in params or e.response["Error"]["Code"] not in [
+                "ValidationException",
+                "ResourceNotFound",
+            ]:
+                raise
+
+            # Fall back to the Studio home page
+            logger.warning(e)
+            params.pop("SpaceName")
+            params.pop("LandingUri")
+            with timed("CreatePresignedUrl"):
+                response = sm_client.create_presigned_domain_url(**params)
+
         presigned = response["AuthorizedUrl"]
 
     except sm_client.exceptions.ResourceNotFound as e:
@@ -0,0 +1,481 @@
+"""Local load test for the /geturl Lambda
+
+Invokes lambda_handler in gen_presign_signin/app.py in-process, concurrently,
+replaying an arrival curve. DynamoDB and SageMaker are replaced with in-memory
+fakes that inject latency, so no AWS account is needed.
+
+Each simulated Lambda execution environment is a fresh import of app.py. An
+invocation that finds no idle environment creates one (a cold start). When
+the concurrency limit is reached, invocations are throttled like API Gateway
+would with a 429.
+
+Usage:
+    python loadtest/loadtest.py --users 500 --duration 60 --curve kickoff
+"""
+import argparse
+import contextlib
+import importlib.util
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+APP_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "gen_presign_signin", "app.py"
+)
+
+TABLE_NAME = "studio-cli-loadtest"
+DOMAIN_ID = "d-loadtest"
+
+
+class Latency(object):
+    """Sleeps for a normally distributed time to simulate a downstream call"""
+
+    def __init__(self, mean_ms: float, jitter_ms: float, time_scale: float) -> None:
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+        self.time_scale = time_scale
+
+    def sleep(self) -> None:
+        latency_ms = max(0, random.gauss(self.mean_ms, self.jitter_ms))
+        time.sleep(latency_ms / 1000 * self.time_scale)
+
+
+class CallCounter(object):
+    """Thread-safe count of downstream calls per operation"""
+
+    def __init__(self) -> None:
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, operation: str) -> None:
+        with self.lock:
+            self.counts[operation] += 1
+
+
+class FakeResourceNotFound(Exception):
+    pass
+
+
+class FakeTable(object):
+    def __init__(self, items: dict, latency: Latency, calls: CallCounter) -> None:
+        self.items = items
+        self.latency = latency
+        self.calls = calls
+
+    def get_item(self, Key, **kwargs):
+        self.calls.add("dynamodb:GetItem")
+        self.latency.sleep()
+
+        item = self.items.get(Key["pk"])
+        return {"Item": dict(item)} if item else {}
+
+
+class FakeDynamoDB(object):
+    """Stands in for both the DynamoDB client and resource"""
+
+    def __init__(self, items: dict, latency: Latency, calls: CallCounter) -> None:
+        self.table = FakeTable(items, latency, calls)
+        self.latency = latency
+        self.calls = calls
+
+    def list_tables(self, **kwargs):
+        self.calls.add("dynamodb:ListTables")
+        self.latency.sleep()
+
+        return {"TableNames": [TABLE_NAME]}
+
+    def Table(self, name):
+        return self.table
+
+
+class FakeSageMaker(object):
+    def __init__(self, latency: Latency, calls: CallCounter, error_rate: float) -> None:
+        self.latency = latency
+        self.calls = calls
+        self.error_rate = error_rate
+        self.exceptions = mock.Mock(ResourceNotFound=FakeResourceNotFound)
+
+    def describe_space(self, DomainId, SpaceName, **kwargs):
+        self.calls.add("sagemaker:DescribeSpace")
+        self.latency.sleep()
+
+        return {"SpaceName": SpaceName, "Status": "InService"}
+
+    def create_presigned_domain_url(self, DomainId, UserProfileName, **kwargs):
+        self.calls.add("sagemaker:CreatePresignedDomainUrl")
+        self.latency.sleep()
+
+        if random.random() < self.error_rate:
+            raise FakeResourceNotFound(f"User profile {UserProfileName} not found")
+
+        return {
+            "AuthorizedUrl": f"https://{DomainId}.studio.example.com/auth?token={uuid.uuid4()}"
+        }
+
+
+class FakeContext(object):
+    """Minimal Lambda context accepted by powertools"""
+
+    function_name = "GenSigninUrlFunction"
+    function_version = "$LATEST"
+    memory_limit_in_mb = 128
+    invoked_function_arn = (
+        "arn:aws:lambda:eu-west-1:123456789012:function:GenSigninUrlFunction"
+    )
+
+    def __init__(self) -> None:
+        self.aws_request_id = str(uuid.uuid4())
+
+
+class ContainerPool(object):
+    """Simulated Lambda execution environments
+
+    Each environment is a separate import of app.py, so module level state
+    (clients, cached table names) behaves like it does in Lambda.
+    """
+
+    def __init__(self, concurrency: int, fakes: dict) -> None:
+        self.concurrency = concurrency
+        self.fakes = fakes
+        self.idle = []
+        self.busy = 0
+        self.created = 0
+        self.init_times = []
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+
+    def acquire(self) -> tuple:
+        """Gets an idle environment, or reserves a slot for a new one
+
+        Returns:
+            tuple: (environment or None for a cold start, False if throttled)
+        """
+
+        with self.lock:
+            if self.idle:
+                self.busy += 1
+                return self.idle.pop(), True
+
+            if self.busy + len(self.idle) >= self.concurrency:
+                return None, False
+
+            self.busy += 1
+            return None, True
+
+    def create(self):
+        """Runs the module initialization of app.py, like a cold start does"""
+
+        name = f"app_container_{next(self.ids)}"
+        spec = importlib.util.spec_from_file_location(name, APP_PATH)
+        module = importlib.util.module_from_spec(spec)
+
+        # boto3 is patched for the whole run, see run()
+        start = time.perf_counter()
+        spec.loader.exec_module(module)
+        init_time = time.perf_counter() - start
+
+        with self.lock:
+            self.created += 1
+            self.init_times.append(init_time)
+
+        return module, init_time
+
+    def release(self, container) -> None:
+        with self.lock:
+            self.busy -= 1
+            if container is not None:
+                self.idle.append(container)
+
+    def get_fake(self, service_name, *args, **kwargs):
+        return self.fakes[service_name]
+
+
+def get_arrivals(curve: str, users: int, duration: float) -> list:
+    """Gets arrival offsets in seconds for an arrival curve
+
+    Parameters:
+        curve (str): uniform, poisson or kickoff
+        users (int): Number of arrivals
+        duration (float): Seconds over which users arrive
+
+    Returns:
+        list: Sorted arrival offsets
+    """
+
+    if curve == "uniform":
+        return [i * duration / users for i in range(users)]
+
+    if curve == "poisson":
+        offsets = []
+        offset = 0
+        for _ in range(users):
+            offset += random.expovariate(users / duration)
+            offsets.append(offset)
+        # Stretch to the requested duration
+        return [o * duration / offsets[-1] for o in offsets]
+
+    # kickoff: everyone is told to log in at once. Arrivals decay exponentially,
+    # with most of them in the first fifth of the window
+    offsets = [random.expovariate(5 / duration) for _ in range(users)]
+    return sorted(min(o, duration) for o in offsets)
+
+
+def percentile(values: list, p: float) -> float:
+    """Nearest-rank percentile"""
+
+    if not values:
+        return float("nan")
+
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def run(options) -> dict:
+    """Replays the arrival curve against the handler and collects results"""
+
+    random.seed(options.seed)
+
+    calls = CallCounter()
+    ddb_latency = Latency(options.ddb_latency_ms, options.ddb_jitter_ms, options.time_scale)
+    sm_latency = Latency(options.sm_latency_ms, options.sm_jitter_ms, options.time_scale)
+
+    roster = {
+        f"user{i}@example.com": {
+            "pk": f"user{i}@example.com",
+            "team": i % 50,
+            "domain-id": DOMAIN_ID,
+            "provisioning-status": (
+                "pending" if random.random() < options.pending_rate else "ready"
+            ),
+            "access-start": int(time.time()) - 3600,
+            "access-end": int(time.time()) + 3600,
+        }
+        for i in range(options.users)
+    }
+
+    dynamodb = FakeDynamoDB(roster, ddb_latency, calls)
+    fakes = {
+        "dynamodb": dynamodb,
+        "sagemaker": FakeSageMaker(sm_latency, calls, options.sm_error_rate),
+    }
+    pool = ContainerPool(options.concurrency, fakes)
+
+    results = []
+    results_lock = threading.Lock()
+
+    def invoke(email: str) -> None:
+        start = time.perf_counter()
+        container, admitted = pool.acquire()
+
+        if not admitted:
+            with results_lock:
+                results.append({"status": 429, "latency": 0, "cold": False})
+            return
+
+        cold = container is None
+        try:
+            if cold:
+                container, _ = pool.create()
+
+            body = {"email": email}
+            if options.landing:
+                body["landing"] = options.landing
+
+            event = {
+                "body": json.dumps(body),
+                "requestContext": {"requestId": str(uuid.uuid4())},
+            }
+            response = container.lambda_handler(event, FakeContext())
+            status = response["statusCode"]
+        except Exception as e:
+            print(f"Invocation raised: {e!r}", file=sys.stderr)
+            status = "exception"
+        finally:
+            pool.release(container)
+
+        latency = (time.perf_counter() - start) / options.time_scale
+        with results_lock:
+            results.append({"status": status, "latency": latency, "cold": cold})
+
+    emails = list(roster)
+    unknown = itertools.count()
+    arrivals = get_arrivals(options.curve, options.users, options.duration)
+
+    # Patched once for the whole run. Patching per cold start isn't thread-safe.
+    patchers = [
+        mock.patch("boto3.client", side_effect=pool.get_fake),
+        mock.patch("boto3.resource", side_effect=pool.get_fake),
+    ]
+    for patcher in patchers:
+        patcher.start()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=options.concurrency + 1) as executor:
+        for i, offset in enumerate(arrivals):
+            delay = start + offset * options.time_scale - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            if random.random() < options.unknown_rate:
+                email = f"unknown{next(unknown)}@example.com"
+            else:
+                email = emails[i]
+
+            executor.submit(invoke, email)
+    elapsed = (time.perf_counter() - start) / options.time_scale
+
+    for patcher in patchers:
+        patcher.stop()
+
+    return {
+        "results": results,
+        "calls": dict(calls.counts),
+        "containers": pool.created,
+        "init_times": pool.init_times,
+        "elapsed": elapsed,
+    }
+
+
+def report(run_results: dict) -> dict:
+    """Summarizes latencies, status codes and downstream calls"""
+
+    results = run_results["results"]
+    invoked = [r for r in results if r["status"] != 429]
+
+    def latency_summary(latencies):
+        return {
+            "count": len(latencies),
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_ms": max(latencies, default=float("nan")) * 1000,
+        }
+
+    statuses = Counter(str(r["status"]) for r in results)
+    errors = sum(
+        count for status, count in statuses.items() if not status.startswith("2")
+    )
+
+    return {
+        "requests": len(results),
+        "elapsed_s": run_results["elapsed"],
+        "statuses": dict(statuses),
+        "error_rate": errors / len(results) if results else 0,
+        "throttled": statuses.get("429", 0),
+        "latency": {
+            "all": latency_summary([r["latency"] for r in invoked]),
+            "cold": latency_summary([r["latency"] for r in invoked if r["cold"]]),
+            "warm": latency_summary([r["latency"] for r in invoked if not r["cold"]]),
+        },
+        "containers": run_results["containers"],
+        "init_p50_ms": percentile(run_results["init_times"], 50) * 1000,
+        "downstream_calls": run_results["calls"],
+    }
+
+
+def print_report(summary: dict) -> None:
+    print(
+        f"\n{summary['requests']} requests in {summary['elapsed_s']:.1f}s, "
+        f"{summary['containers']} execution environments "
+        f"(init p50 {summary['init_p50_ms']:.1f} ms)"
+    )
+    print(
+        f"Status codes: {summary['statuses']}  "
+        f"error rate {summary['error_rate']:.1%}, throttled {summary['throttled']}\n"
+    )
+
+    print(f"{'':6}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, latency in summary["latency"].items():
+        print(
+            f"{name:6}{latency['count']:>7}{latency['p50_ms']:>10.1f}"
+            f"{latency['p95_ms']:>10.1f}{latency['p99_ms']:>10.1f}{latency['max_ms']:>10.1f}"
+        )
+
+    print("\nDownstream calls:")
+    for operation, count in sorted(summary["downstream_calls"].items()):
+        print(f"  {operation:40}{count:>7}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=500, help="Number of requests")
+    parser.add_argument(
+        "--duration", type=float, default=60, help="Seconds over which users arrive"
+    )
+    parser.add_argument(
+        "--curve", choices=["uniform", "poisson", "kickoff"], default="kickoff"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=100,
+        help="Maximum concurrent executions before requests are throttled",
+    )
+    parser.add_argument("--ddb-latency-ms", type=float, default=8)
+    parser.add_argument("--ddb-jitter-ms", type=float, default=3)
+    parser.add_argument("--sm-latency-ms", type=float, default=250)
+    parser.add_argument("--sm-jitter-ms", type=float, default=80)
+    parser.add_argument(
+        "--sm-error-rate",
+        type=float,
+        default=0,
+        help="Share of SageMaker calls failing with ResourceNotFound",
+    )
+    parser.add_argument(
+        "--unknown-rate",
+        type=float,
+        default=0,
+        help="Share of requests for emails that aren't in the roster",
+    )
+    parser.add_argument(
+        "--pending-rate",
+        type=float,
+        default=0,
+        help="Share of users whose environment is still being set up",
+    )
+    parser.add_argument(
+        "--landing", choices=["home", "jupyter", "code-editor"], help="Sent in the body"
+    )
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=1,
+        help="Multiplies arrival offsets and injected latencies, i.e 0.1 runs 10x faster",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument(
+        "--show-logs", action="store_true", help="Show the Lambda's own log output and metrics"
+    )
+    options = parser.parse_args()
+
+    if not options.show_logs:
+        os.environ["POWERTOOLS_LOG_LEVEL"] = "CRITICAL"
+
+    if options.show_logs:
+        summary = report(run(options))
+    else:
+        # Cold start and outcome metrics are printed even with metrics disabled
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            summary = report(run(options))
+
+    if options.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_report(summary)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,11 +5,15 @@ import { Button, Text, Card, Spacer, Input, Loading } from "@geist-ui/core";
 
 import { postEmail, isValidEmail } from "./utils/helpers";
 
+// Stop retrying after this long, the environment is most likely stuck
+const MAX_WAIT_MS = 15 * 60 * 1000;
+
 const AppComponent = () => {
   const [email, setEmail] = useState("");
   const [loading, setLoading] = useState(false);
   const [validationError, setValidationError] = useState("");
   const [error, setError] = useState("");
+  const [message, setMessage] = useState("");
 
   const onEmailChange = (e) => {
     setEmail(e.target.value);
@@ -24,8 +28,27 @@ const AppComponent = () => {
 
     setLoading(true);
 
+    await requestUrl(email);
+    setEmail("");
+  };
+
+  const requestUrl = async (email, startedAt = Date.now()) => {
     const res = await postEmail(email);
 
+    if (res.status == 202 && res.data && res.data.retryAfter) {
+      if (Date.now() - startedAt > MAX_WAIT_MS) {
+        setError(
+          "Your environment is taking longer than expected. Please ask an organiser for help"
+        );
+        return;
+      }
+
+      // environment is being prepared --> keep the user posted and try again
+      setMessage(res.message);
+      setTimeout(() => requestUrl(email, startedAt), res.data.retryAfter * 1000);
+      return;
+    }
+
     if (res.status !== 200) {
       setError(res.message);
     }
@@ -34,7 +57,6 @@ const AppComponent = () => {
       // presigned generated --> redirect user to SageMaker Studio
       window.location.replace(res.data.presigned);
     }
-    setEmail("");
   };
 
   const renderContent = () => {
@@ -49,7 +71,12 @@ const AppComponent = () => {
     }
 
     if (loading) {
-      return <Loading scale={9 / 3} type="warning" />;
+      return (
+        <Grid.Container direction="column" alignItems="center">
+          <Loading scale={9 / 3} type="warning" />
+          {message ? <Text h4>{message}</Text> : null}
+        </Grid.Container>
+      );
     }
 
     return (
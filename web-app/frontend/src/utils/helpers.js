@@ -7,7 +7,7 @@ export const postEmail = async (email) => {
     const res = await axios.post(API_URL, {
       email,
     });
-    return { status: res.status, data: res.data };
+    return { status: res.status, data: res.data, message: res.data.message };
   } catch (error) {
     return {
       status: error.response.status,